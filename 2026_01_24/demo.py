@@ -1,7 +1,286 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Optional
 
 import requests
 from pydantic import BaseModel, Field
+from requests.adapters import HTTPAdapter
+
+# 翻譯用的模型與提示詞版本：修改提示詞時請遞增版本，舊的快取就不會再被使用
+TRANSLATE_MODEL = "gpt-oss:20b-cloud"
+PROMPT_VERSION = "v2"
+# Gemini 備援的系統提示詞與版本（模型由 valves.gemini_model 設定），快取鍵與 Ollama 分開
+GEMINI_PROMPT = "請把輸入的繁體中文,轉換為英文,[[0]] 這類佔位符原樣保留"
+GEMINI_PROMPT_VERSION = "v2"
+
+# 確保 IP 正確（Raspberry Pi 的實體 IP）
+OLLAMA_URL = "http://127.0.0.1:11434"
+
+# 共用的連線（keep-alive + 連線池），不必每次翻譯都重新建立 TCP 連線
+OLLAMA_SESSION = requests.Session()
+OLLAMA_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
+# 遠端備援：Gemini
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+GEMINI_SESSION = requests.Session()
+
+# 同時進行的翻譯請求（主要後端 + 備援後端）
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="translate")
+
+# 程式碼區塊（``` 或 ~~~，未結束的區塊視為到結尾）、行內程式碼與網址不需要翻譯
+RE_CODE_BLOCK = re.compile(r"(```.*?(?:```|\Z)|~~~.*?(?:~~~|\Z))", re.DOTALL)
+RE_SKIP = re.compile(r"`[^`\n]*`|https?://\S+")
+RE_CJK = re.compile(r"[㄀-ㄯ㐀-䶿一-鿿豈-﫿]")
+RE_LATIN = re.compile(r"[A-Za-z]")
+# 合併翻譯時代表不翻譯片段的佔位符（還原時連同模型在周圍加上的空白一起取代）
+RE_PLACEHOLDER = re.compile(r"\[\[(\d+)\]\]")
+RE_PLACEHOLDER_WS = re.compile(r"\s*\[\[(\d+)\]\]\s*")
+
+
+def cjk_ratio(text: str) -> float:
+    """中文字佔（中文字 + 英文字母）的比例，不計行內程式碼與網址。"""
+    text = RE_SKIP.sub(" ", text)
+    cjk = len(RE_CJK.findall(text))
+    if not cjk:
+        return 0.0
+    return cjk / (cjk + len(RE_LATIN.findall(text)))
+
+
+def plan_translation(text: str, min_cjk_ratio: float) -> list[tuple[str, bool]]:
+    """
+    把訊息切成（片段, 是否需要翻譯）：程式碼區塊原樣保留，
+    其餘文字含有中文且比例達到 min_cjk_ratio 才翻譯（英文、數字、網址直接略過）。
+    """
+    segments = []
+    for part in RE_CODE_BLOCK.split(text):
+        if not part:
+            continue
+        is_code = RE_CODE_BLOCK.fullmatch(part) is not None
+        ratio = 0.0 if is_code else cjk_ratio(part)
+        needs = ratio > 0 and ratio >= min_cjk_ratio
+        segments.append((part, needs))
+    return segments
+
+
+def join_translated(segments: list[tuple[str, bool]], translate) -> str:
+    """
+    需要翻譯的片段合併成一次 translate：不翻譯的片段（程式碼區塊等）連同相鄰的空白與換行
+    換成 [[n]] 佔位符，譯文中的佔位符再換回原文。譯文的佔位符對不上時改為逐段翻譯。
+    """
+    # 拆成（文字, 是否翻譯），需要翻譯的片段去掉前後空白，空白併入相鄰的保留片段
+    chunks = []
+    for part, needs in segments:
+        if needs:
+            stripped = part.strip()
+            lead = part[: len(part) - len(part.lstrip())]
+            pieces = [(lead, False), (stripped, True), (part[len(lead) + len(stripped) :], False)]
+        else:
+            pieces = [(part, False)]
+        for text, translate_it in pieces:
+            if not text:
+                continue
+            if not translate_it and chunks and not chunks[-1][1]:
+                chunks[-1][0] += text
+            else:
+                chunks.append([text, translate_it])
+    # 開頭、結尾保留的片段不送出
+    prefix = chunks.pop(0)[0] if chunks and not chunks[0][1] else ""
+    suffix = chunks.pop()[0] if chunks and not chunks[-1][1] else ""
+    if not chunks:
+        return prefix + suffix
+
+    kept = [text for text, translate_it in chunks if not translate_it]
+    template, n = [], 0
+    for text, translate_it in chunks:
+        if translate_it:
+            template.append(text)
+        else:
+            template.append(f"[[{n}]]")
+            n += 1
+    translated = translate("".join(template))
+    if sorted(int(i) for i in RE_PLACEHOLDER.findall(translated)) == list(range(len(kept))):
+        body = RE_PLACEHOLDER_WS.sub(lambda m: kept[int(m.group(1))], translated)
+    else:
+        print("[翻譯] 譯文的佔位符不符，改為逐段翻譯")
+        body = "".join(translate(text) if translate_it else text for text, translate_it in chunks)
+    return prefix + body + suffix
+
+
+class TranslationCache:
+    """
+    翻譯快取：記憶體 LRU，可選擇同時寫入 SQLite（重新啟動後仍保留）。
+    temperature 為 0，同樣的輸入會得到同樣的翻譯，重複的問題或重新產生回答都不必再呼叫模型。
+    """
+
+    def __init__(self, max_entries: int = 500, db_path: str = ""):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, value TEXT, used REAL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"[翻譯快取] 無法開啟 {db_path}，只使用記憶體: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(text: str, model: str, prompt_version: str = PROMPT_VERSION) -> str:
+        # 去掉前後空白並合併連續空白，避免只差空白的訊息重新翻譯
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{model}\n{prompt_version}\n{normalized}".encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        return self.get_any([key])
+
+    def get_any(self, keys: list[str]) -> str | None:
+        """依序查詢多個鍵，回傳第一個找到的譯文（只算一次命中或未命中）。"""
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return self._memory[key]
+            if self._db is not None:
+                for key in keys:
+                    row = self._db.execute(
+                        "SELECT value FROM translations WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row:
+                        self._db.execute(
+                            "UPDATE translations SET used = julianday('now') WHERE key = ?", (key,)
+                        )
+                        self._db.commit()
+                        self._remember(key, row[0])
+                        self.hits += 1
+                        return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, julianday('now'))",
+                    (key, value),
+                )
+                # 超過上限時刪除最久沒用到的翻譯
+                self._db.execute(
+                    "DELETE FROM translations WHERE key IN ("
+                    " SELECT key FROM translations ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, value: str):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+class CircuitBreaker:
+    """連續失敗 max_failures 次後暫停使用該後端 reset_after 秒，之後放行一次試探。"""
+
+    def __init__(self, max_failures: int = 3, reset_after: float = 60):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # 半開：放行一次，成功就恢復，失敗就重新計時
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.max_failures:
+                    self.opened_at = time.monotonic()
+
+
+class HedgedTranslator:
+    """
+    依序排列的翻譯後端（名稱, 函式(text, cancel) -> 譯文）。先呼叫第一個，
+    hedge_delay 秒內沒有結果（或失敗）就同時呼叫下一個，採用最先成功的結果，
+    並取消其他請求（執行中的後端透過 cancel 停止）。熔斷中的後端會被略過。
+    """
+
+    def __init__(self, backends: list, hedge_delay: float, timeout: float, breakers: dict):
+        self.backends = backends
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.breakers = breakers
+
+    def translate(self, text: str) -> tuple[str, str] | None:
+        """回傳（譯文, 後端名稱），全部失敗或逾時則回傳 None。"""
+        cancel = threading.Event()
+        deadline = time.monotonic() + self.timeout
+        pending = {}
+        waiting = list(self.backends)
+        try:
+            while waiting or pending:
+                if waiting:
+                    name, fn = waiting.pop(0)
+                    # 真的要送出時才詢問熔斷器：半開的後端沒用到就不會佔掉試探機會
+                    if not self.breakers[name].allow():
+                        continue
+                    pending[HEDGE_EXECUTOR.submit(fn, text, cancel)] = name
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # 還有備援後端時只等 hedge_delay，否則等到最後期限
+                done, _ = wait(
+                    pending,
+                    timeout=min(self.hedge_delay, remaining) if waiting else remaining,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"[翻譯] {name} 失敗: {e}")
+                        result = None
+                    self.breakers[name].record(bool(result))
+                    if result:
+                        return result, name
+            # 逾時：還在排隊的請求直接取消，已經開始卻沒完成的後端才算一次失敗
+            for future, name in pending.items():
+                if not future.cancel():
+                    self.breakers[name].record(False)
+            return None
+        finally:
+            # 通知執行中的後端停止，並取消還沒開始的請求
+            cancel.set()
+            for future in pending:
+                future.cancel()
 
 
 class Filter:
@@ -10,10 +289,63 @@ class Filter:
         enable_translation: bool = Field(
             default=True, description="是否啟用自動翻譯為英文"
         )
+        cache_max_entries: int = Field(default=500, description="翻譯快取最多保留幾筆")
+        cache_db_path: str = Field(
+            default="", description="翻譯快取的 SQLite 檔案路徑（空白則只存在記憶體）"
+        )
+        min_cjk_ratio: float = Field(
+            default=0.2, description="中文字比例達到多少才翻譯（英文、程式碼、網址直接略過）"
+        )
+        keep_alive: str = Field(
+            default="30m", description="翻譯模型在 Ollama 保持載入的時間（例如 30m、-1 永久）"
+        )
+        warmup: bool = Field(default=True, description="載入 Filter 時先預熱翻譯模型")
+        gemini_api_key: str = Field(
+            default=os.getenv("GOOGLE_API_KEY", ""),
+            description="Gemini API Key（空白則不使用 Gemini 備援）",
+        )
+        gemini_model: str = Field(default="gemini-3-flash-preview", description="備援翻譯模型")
+        hedge_delay: float = Field(
+            default=3.0, description="Ollama 幾秒內沒有結果就同時詢問 Gemini"
+        )
+        translate_timeout: float = Field(default=20.0, description="翻譯最長等待秒數")
+        breaker_failures: int = Field(default=3, description="連續失敗幾次後暫停使用該後端")
+        breaker_reset: float = Field(default=60.0, description="暫停多少秒後再試一次")
         pass
 
     def __init__(self):
         self.valves = self.Valves()
+        self.cache = None
+        self.breakers = {"ollama": CircuitBreaker(), "gemini": CircuitBreaker()}
+        if self.valves.warmup:
+            # 背景預熱，不拖慢 Filter 載入
+            threading.Thread(target=self._warmup, daemon=True).start()
+
+    def _warmup(self):
+        # 沒有 prompt 的 generate 只會載入模型，keep_alive 讓它留在記憶體
+        start = time.perf_counter()
+        try:
+            response = OLLAMA_SESSION.post(
+                f"{OLLAMA_URL}/api/generate",
+                json={"model": TRANSLATE_MODEL, "keep_alive": self.valves.keep_alive},
+                timeout=120,
+            )
+            response.raise_for_status()
+            print(f"[Company A] 翻譯模型已預熱（{time.perf_counter() - start:.1f} 秒）")
+        except Exception as e:
+            print(f"[Company A] 翻譯模型預熱失敗: {e}")
+
+    def _get_cache(self) -> TranslationCache:
+        # valves 可能在管理介面被修改，設定不同時重新建立快取
+        if (
+            self.cache is None
+            or self.cache.max_entries != self.valves.cache_max_entries
+            or self.cache.db_path != self.valves.cache_db_path
+        ):
+            self.cache = TranslationCache(
+                self.valves.cache_max_entries, self.valves.cache_db_path
+            )
+        return self.cache
 
     def inlet(self, body: dict, __user__: dict | None = None) -> dict:
         # 1. 取得使用者最後一句話
@@ -26,9 +358,17 @@ class Filter:
                 # 或者您可以指定一個特定的模型 (例如 'llama3')
                 model_id = body.get("model")
 
+                # 先在本機判斷：沒有中文（英文、程式碼、網址、數字）就不呼叫模型
+                segments = plan_translation(user_message, self.valves.min_cjk_ratio)
+                if not any(needs for _, needs in segments):
+                    print("[Company A] 不需要翻譯，略過")
+                    return body
+
                 # 構造一個翻譯請求（這是一個簡單的技巧：在背後偷偷呼叫 API）
-                # 注意：這會增加一點點延遲
-                translated_text = self._translate_to_english(user_message, model_id)
+                # 注意：這會增加一點點延遲；只送出中文片段，程式碼區塊原樣保留
+                translated_text = join_translated(
+                    segments, lambda text: self._translate_to_english(text, model_id)
+                )
 
                 # 3. 將翻譯後的內容寫回 body
                 print(f"[Company A] 原始內容: {user_message}")
@@ -42,38 +382,114 @@ class Filter:
         return body
 
     def _translate_to_english(self, text: str, model_id: str | None):
-        # 1. 確保 IP 正確（Raspberry Pi 的實體 IP）
-        host_ip = "127.0.0.1"
-        url = f"http://{host_ip}:11434/api/generate"
+        # 相同的內容已經由任一後端翻譯過，直接使用快取（鍵含該後端的模型與提示詞版本）
+        cache = self._get_cache()
+        backends = self._backends()
+        cache_keys = {
+            name: cache.make_key(text, *self._cache_identity(name)) for name, _ in backends
+        }
+        cached = cache.get_any(list(cache_keys.values()))
+        if cached is not None:
+            print(f"[翻譯快取] 命中（命中 {cache.hits} / 未命中 {cache.misses}）")
+            return cached
+        print(f"[翻譯快取] 未命中（命中 {cache.hits} / 未命中 {cache.misses}）")
+
+        # 先問本機 Ollama，hedge_delay 秒內沒有回覆就同時問 Gemini，誰先完成就用誰
+        translator = HedgedTranslator(
+            backends,
+            hedge_delay=self.valves.hedge_delay,
+            timeout=self.valves.translate_timeout,
+            breakers=self.breakers,
+        )
+        result = translator.translate(text)
+        if result is None:
+            print("翻譯請求失敗: 沒有可用的翻譯後端")
+            return text
+        translated, backend = result
+        print(f"[翻譯] 使用 {backend}")
+
+        # 過濾掉可能出現的引號
+        translated = translated.replace('"', "")
+        # 存在實際產生譯文的後端的鍵下
+        cache.set(cache_keys[backend], translated)
+        return translated
+
+    def _cache_identity(self, backend: str) -> tuple[str, str]:
+        """快取鍵使用的（模型, 提示詞版本），依後端而不同。"""
+        if backend == "gemini":
+            return self.valves.gemini_model, GEMINI_PROMPT_VERSION
+        return TRANSLATE_MODEL, PROMPT_VERSION
+
+    def _backends(self) -> list:
+        for breaker in self.breakers.values():
+            breaker.max_failures = self.valves.breaker_failures
+            breaker.reset_after = self.valves.breaker_reset
+        backends = [("ollama", self._ollama_translate)]
+        if self.valves.gemini_api_key:
+            backends.append(("gemini", self._gemini_translate))
+        return backends
+
+    def _ollama_translate(self, text: str, cancel: threading.Event) -> str:
+        # 1. Ollama 的 generate API
+        url = f"{OLLAMA_URL}/api/generate"
 
         # 2. 嚴格的翻譯指令
-        prompt = f"Translate the following Chinese text to English. Output ONLY the English translation, no explanation.\nText: {text}\nEnglish:"
+        prompt = f"Translate the following Chinese text to English. Keep placeholders such as [[0]] exactly as they are. Output ONLY the English translation, no explanation.\nText: {text}\nEnglish:"
 
         payload = {
-            "model": "gpt-oss:20b-cloud",  # 不可以使用model_id(因為我們使用雲模型,必需明確指定模型名稱)
+            "model": TRANSLATE_MODEL,  # 不可以使用model_id(因為我們使用雲模型,必需明確指定模型名稱)
             "prompt": prompt,
-            "stream": False,
+            "stream": True,  # 邊產生邊讀，翻譯那一行結束就不再等待
+            "keep_alive": self.valves.keep_alive,
             "options": {"temperature": 0.0},  # 讓翻譯結果最精確
         }
+        # 原文只有一行時，譯文也只取一行
+        single_line = "\n" not in text
 
-        try:
-            # 設定較長的 timeout，因為 Raspberry Pi 運算較慢
-            response = requests.post(url, json=payload, timeout=20)
+        if cancel.is_set():
+            # 另一個後端已經完成，不必再送出請求
+            return ""
 
+        # 設定較長的 timeout，因為 Raspberry Pi 運算較慢
+        with OLLAMA_SESSION.post(url, json=payload, timeout=20, stream=True) as response:
             if response.status_code == 404:
-                print("錯誤：找不到 API 路徑，請檢查 Ollama 版本")
-                return text
+                raise RuntimeError("找不到 API 路徑，請檢查 Ollama 版本")
 
             response.raise_for_status()
-            result = response.json()
-            translated = result.get("response", "").strip()
-
-            # 過濾掉可能出現的引號
-            return translated.replace('"', "") if translated else text
+            translated = ""
+            for line in response.iter_lines():
+                if cancel.is_set():
+                    # 另一個後端已經完成，關閉連線讓 Ollama 停止產生
+                    return ""
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                translated += chunk.get("response", "")
+                if chunk.get("done"):
+                    break
+                if single_line and "\n" in translated.lstrip():
+                    # 提前結束：關閉連線後 Ollama 會停止產生
+                    translated = translated.lstrip().split("\n", 1)[0]
+                    break
+        return translated.strip()
 
-        except Exception as e:
-            print(f"翻譯請求失敗: {e}")
-            return text
+    def _gemini_translate(self, text: str, cancel: threading.Event) -> str:
+        # Gemini REST API（不需要安裝 google-genai）
+        if cancel.is_set():
+            return ""
+        response = GEMINI_SESSION.post(
+            f"{GEMINI_URL}/{self.valves.gemini_model}:generateContent",
+            headers={"x-goog-api-key": self.valves.gemini_api_key},
+            json={
+                "system_instruction": {"parts": [{"text": GEMINI_PROMPT}]},
+                "contents": [{"parts": [{"text": text}]}],
+                "generationConfig": {"temperature": 0.0},
+            },
+            timeout=self.valves.translate_timeout,
+        )
+        response.raise_for_status()
+        parts = response.json()["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts).strip()
 
         def outlet(self, body: dict, __user__: Optional[dict] = None) -> dict:
             if body.get("messages"):
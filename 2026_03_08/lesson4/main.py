@@ -3,28 +3,296 @@ title: 最簡單的架構
 author: 徐國堂
 version: 1.0
 description: 這是一般的資料
-requirements: requests, pydantic, google-genai
+requirements: requests, google-genai
 """
 
-from typing import Optional
-from pydantic import BaseModel, Field
-from google import genai
-from google.genai import types
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-client = genai.Client() # 這裡會自動從環境變數 GOOGLE_API_KEY 讀取 API Key
+# google-genai 與 requests 在第一次翻譯時才匯入，Open WebUI 載入/重新載入 Filter 幾乎不花時間
+_client = None
+_client_lock = threading.Lock()
+
+# 第一次呼叫的耗時（毫秒），用 timing_report() 查看；載入耗時由呼叫端量測（見 test_main.py）
+TIMINGS = {"sdk_import_ms": None, "client_init_ms": None, "first_call_ms": None}
+
+
+def timing_report() -> str:
+    return ", ".join(f"{k}={'-' if v is None else f'{v:.1f}'}" for k, v in TIMINGS.items())
+
+
+def get_client():
+    """第一次呼叫時建立 Gemini client，之後重複使用（自動從環境變數 GOOGLE_API_KEY 讀取 API Key）。"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                start = time.perf_counter()
+                from google import genai
+
+                TIMINGS["sdk_import_ms"] = (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                _client = genai.Client()
+                TIMINGS["client_init_ms"] = (time.perf_counter() - start) * 1000
+                print(f"[Filter] Gemini client 已建立: {timing_report()}")
+    return _client
+
+# 中文字比例達到多少才翻譯（英文、程式碼、網址直接略過）
+MIN_CJK_RATIO = 0.2
+
+# 備援翻譯：本機 Ollama
+OLLAMA_URL = "http://127.0.0.1:11434"
+OLLAMA_MODEL = "gpt-oss:20b-cloud"
+HEDGE_DELAY = 3.0  # Gemini 幾秒內沒有結果就同時詢問 Ollama
+TRANSLATE_TIMEOUT = 20.0  # 翻譯最長等待秒數
+
+# 同時進行的翻譯請求（主要後端 + 備援後端）
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="translate")
+
+# 程式碼區塊（``` 或 ~~~，未結束的區塊視為到結尾）、行內程式碼與網址不需要翻譯
+RE_CODE_BLOCK = re.compile(r"(```.*?(?:```|\Z)|~~~.*?(?:~~~|\Z))", re.DOTALL)
+RE_SKIP = re.compile(r"`[^`\n]*`|https?://\S+")
+RE_CJK = re.compile(r"[㄀-ㄯ㐀-䶿一-鿿豈-﫿]")
+RE_LATIN = re.compile(r"[A-Za-z]")
+# 合併翻譯時代表不翻譯片段的佔位符（還原時連同模型在周圍加上的空白一起取代）
+RE_PLACEHOLDER = re.compile(r"\[\[(\d+)\]\]")
+RE_PLACEHOLDER_WS = re.compile(r"\s*\[\[(\d+)\]\]\s*")
+
+
+def cjk_ratio(text: str) -> float:
+    """中文字佔（中文字 + 英文字母）的比例，不計行內程式碼與網址。"""
+    text = RE_SKIP.sub(" ", text)
+    cjk = len(RE_CJK.findall(text))
+    if not cjk:
+        return 0.0
+    return cjk / (cjk + len(RE_LATIN.findall(text)))
+
+
+def plan_translation(text: str, min_cjk_ratio: float) -> list[tuple[str, bool]]:
+    """
+    把訊息切成（片段, 是否需要翻譯）：程式碼區塊原樣保留，
+    其餘文字含有中文且比例達到 min_cjk_ratio 才翻譯（英文、數字、網址直接略過）。
+    """
+    segments = []
+    for part in RE_CODE_BLOCK.split(text):
+        if not part:
+            continue
+        is_code = RE_CODE_BLOCK.fullmatch(part) is not None
+        ratio = 0.0 if is_code else cjk_ratio(part)
+        needs = ratio > 0 and ratio >= min_cjk_ratio
+        segments.append((part, needs))
+    return segments
+
+
+def join_translated(segments: list[tuple[str, bool]], translate) -> str:
+    """
+    需要翻譯的片段合併成一次 translate：不翻譯的片段（程式碼區塊等）連同相鄰的空白與換行
+    換成 [[n]] 佔位符，譯文中的佔位符再換回原文。譯文的佔位符對不上時改為逐段翻譯。
+    """
+    # 拆成（文字, 是否翻譯），需要翻譯的片段去掉前後空白，空白併入相鄰的保留片段
+    chunks = []
+    for part, needs in segments:
+        if needs:
+            stripped = part.strip()
+            lead = part[: len(part) - len(part.lstrip())]
+            pieces = [(lead, False), (stripped, True), (part[len(lead) + len(stripped) :], False)]
+        else:
+            pieces = [(part, False)]
+        for text, translate_it in pieces:
+            if not text:
+                continue
+            if not translate_it and chunks and not chunks[-1][1]:
+                chunks[-1][0] += text
+            else:
+                chunks.append([text, translate_it])
+    # 開頭、結尾保留的片段不送出
+    prefix = chunks.pop(0)[0] if chunks and not chunks[0][1] else ""
+    suffix = chunks.pop()[0] if chunks and not chunks[-1][1] else ""
+    if not chunks:
+        return prefix + suffix
+
+    kept = [text for text, translate_it in chunks if not translate_it]
+    template, n = [], 0
+    for text, translate_it in chunks:
+        if translate_it:
+            template.append(text)
+        else:
+            template.append(f"[[{n}]]")
+            n += 1
+    translated = translate("".join(template))
+    if sorted(int(i) for i in RE_PLACEHOLDER.findall(translated)) == list(range(len(kept))):
+        body = RE_PLACEHOLDER_WS.sub(lambda m: kept[int(m.group(1))], translated)
+    else:
+        print("[翻譯] 譯文的佔位符不符，改為逐段翻譯")
+        body = "".join(translate(text) if translate_it else text for text, translate_it in chunks)
+    return prefix + body + suffix
+
+
+class CircuitBreaker:
+    """連續失敗 max_failures 次後暫停使用該後端 reset_after 秒，之後放行一次試探。"""
+
+    def __init__(self, max_failures: int = 3, reset_after: float = 60):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # 半開：放行一次，成功就恢復，失敗就重新計時
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.max_failures:
+                    self.opened_at = time.monotonic()
+
+
+class HedgedTranslator:
+    """
+    依序排列的翻譯後端（名稱, 函式(text, cancel) -> 譯文）。先呼叫第一個，
+    hedge_delay 秒內沒有結果（或失敗）就同時呼叫下一個，採用最先成功的結果，
+    並取消其他請求（執行中的後端透過 cancel 停止）。熔斷中的後端會被略過。
+    """
+
+    def __init__(self, backends: list, hedge_delay: float, timeout: float, breakers: dict):
+        self.backends = backends
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self.breakers = breakers
+
+    def translate(self, text: str) -> tuple[str, str] | None:
+        """回傳（譯文, 後端名稱），全部失敗或逾時則回傳 None。"""
+        cancel = threading.Event()
+        deadline = time.monotonic() + self.timeout
+        pending = {}
+        waiting = list(self.backends)
+        try:
+            while waiting or pending:
+                if waiting:
+                    name, fn = waiting.pop(0)
+                    # 真的要送出時才詢問熔斷器：半開的後端沒用到就不會佔掉試探機會
+                    if not self.breakers[name].allow():
+                        continue
+                    pending[HEDGE_EXECUTOR.submit(fn, text, cancel)] = name
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # 還有備援後端時只等 hedge_delay，否則等到最後期限
+                done, _ = wait(
+                    pending,
+                    timeout=min(self.hedge_delay, remaining) if waiting else remaining,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"[翻譯] {name} 失敗: {e}")
+                        result = None
+                    self.breakers[name].record(bool(result))
+                    if result:
+                        return result, name
+            # 逾時：還在排隊的請求直接取消，已經開始卻沒完成的後端才算一次失敗
+            for future, name in pending.items():
+                if not future.cancel():
+                    self.breakers[name].record(False)
+            return None
+        finally:
+            # 通知執行中的後端停止，並取消還沒開始的請求
+            cancel.set()
+            for future in pending:
+                future.cancel()
+
+
+def gemini_translate(text: str, cancel: threading.Event) -> str:
+    if cancel.is_set():
+        # 另一個後端已經完成，不必再送出請求
+        return ""
+    first_call = TIMINGS["first_call_ms"] is None
+    start = time.perf_counter()
+    client = get_client()
+    from google.genai import types
+
+    response = client.models.generate_content(
+        model="gemini-3-flash-preview",
+        config=types.GenerateContentConfig(
+            system_instruction="請把輸入的繁體中文,轉換為英文,[[0]] 這類佔位符原樣保留",
+            http_options=types.HttpOptions(timeout=int(TRANSLATE_TIMEOUT * 1000)),
+        ),
+        contents=text,
+    )
+    if first_call:
+        TIMINGS["first_call_ms"] = (time.perf_counter() - start) * 1000
+        print(f"[Filter] 第一次 Gemini 呼叫: {timing_report()}")
+    return response.text
+
+
+def ollama_translate(text: str, cancel: threading.Event) -> str:
+    # 本機 Ollama 備援
+    if cancel.is_set():
+        return ""
+    import requests
+
+    response = requests.post(
+        f"{OLLAMA_URL}/api/generate",
+        json={
+            "model": OLLAMA_MODEL,
+            "prompt": f"Translate the following Chinese text to English. Keep placeholders such as [[0]] exactly as they are. Output ONLY the English translation, no explanation.\nText: {text}\nEnglish:",
+            "stream": False,
+            "options": {"temperature": 0.0},
+        },
+        timeout=TRANSLATE_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json().get("response", "").strip()
+
+
+BREAKERS = {"gemini": CircuitBreaker(), "ollama": CircuitBreaker()}
+TRANSLATOR = HedgedTranslator(
+    [("gemini", gemini_translate), ("ollama", ollama_translate)],
+    hedge_delay=HEDGE_DELAY,
+    timeout=TRANSLATE_TIMEOUT,
+    breakers=BREAKERS,
+)
+
+
+def translate(text: str) -> str:
+    # 先問 Gemini，HEDGE_DELAY 秒內沒有回覆就同時問 Ollama，誰先完成就用誰
+    result = TRANSLATOR.translate(text)
+    if result is None:
+        print("[Filter] 翻譯失敗，保留原文")
+        return text
+    translated, backend = result
+    print(f"[Filter] 使用 {backend} 翻譯")
+    return translated
 
 
 class Filter:
     def inlet(self, body: dict, __user__: dict | None = None) -> dict:
         user_message = body["messages"][-1]["content"]
         print(f"[Filter] 使用者輸入: {user_message}")
-        response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        config=types.GenerateContentConfig(
-                system_instruction="請把輸入的繁體中文,轉換為英文"),
-                contents=user_message)
-        # 請將response.text的內容加入至body內
-        body["messages"][-1]["content"] = response.text        
+        # 沒有中文（英文、程式碼、網址、數字）就不呼叫翻譯
+        segments = plan_translation(user_message, MIN_CJK_RATIO)
+        if not any(needs for _, needs in segments):
+            print("[Filter] 不需要翻譯，略過")
+            return body
+        # 只翻譯中文片段，程式碼區塊原樣保留，再寫回 body
+        body["messages"][-1]["content"] = join_translated(segments, translate)
         return body
 
     def outlet(self, body: dict, __user__: dict | None = None) -> dict:
@@ -32,5 +300,3 @@ class Filter:
         print(f"[Filter Debug] AI 回覆: {assistant_message}")  # 會出現在 Open WebUI 的 log
         # ...
         return body
-
-
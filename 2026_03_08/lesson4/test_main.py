@@ -2,7 +2,131 @@
 直接測試 Filter 邏輯，不需啟動 Open WebUI
 """
 
-from main import Filter
+import time
+
+# 在呼叫端量測載入 main.py 的耗時（Open WebUI 載入 Filter 時付出的成本）
+start = time.perf_counter()
+from main import CircuitBreaker, Filter, HedgedTranslator, timing_report
+
+print(f"載入 main.py: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+from main import join_translated, plan_translation
+
+# 以下不需連網：翻譯規劃、熔斷與 hedged 翻譯的行為
+
+# 英文、程式碼、網址、數字不翻譯
+for text in ["Hello, how are you?", "`print('嗨')`", "https://zh.wikipedia.org/wiki/台灣", "12345"]:
+    assert not any(needs for _, needs in plan_translation(text, 0.2)), text
+assert plan_translation("請介紹台灣", 0.2) == [("請介紹台灣", True)]
+# 中文比例不足（大多是英文）不翻譯
+assert plan_translation("Please explain the Python GIL 謝謝", 0.2) == [
+    ("Please explain the Python GIL 謝謝", False)
+]
+
+# 程式碼區塊原樣保留，區塊外的中文合併成一次翻譯，前後空白與換行不變
+message = "請解釋這段程式：\n```python\n# 中文註解\nprint('你好')\n```\n謝謝\n"
+segments = plan_translation(message, 0.2)
+assert [needs for _, needs in segments] == [True, False, True]
+sent = []
+translated = join_translated(segments, lambda text: sent.append(text) or f"<{text}>")
+assert sent == ["請解釋這段程式：[[0]]謝謝"], sent
+assert translated == "<請解釋這段程式：\n```python\n# 中文註解\nprint('你好')\n```\n謝謝>\n", translated
+# 模型在佔位符周圍加上的空白不影響還原
+translated = join_translated(segments, lambda text: "Explain this code: [[0]] Thanks")
+assert translated == "Explain this code:\n```python\n# 中文註解\nprint('你好')\n```\nThanks\n", translated
+# 譯文的佔位符對不上時改為逐段翻譯
+sent = []
+
+
+def drop_placeholders(text):
+    sent.append(text)
+    return "Explain" if "[[" in text else f"<{text}>"
+
+
+translated = join_translated(segments, drop_placeholders)
+assert sent == ["請解釋這段程式：[[0]]謝謝", "請解釋這段程式：", "謝謝"], sent
+assert translated == "<請解釋這段程式：>\n```python\n# 中文註解\nprint('你好')\n```\n<謝謝>\n", translated
+# 未結束的程式碼區塊視為到結尾
+assert plan_translation("說明：\n```\n未結束的區塊", 0.2)[-1] == ("```\n未結束的區塊", False)
+
+# 熔斷：連續失敗 max_failures 次後打開，reset_after 秒後只放行一次試探
+breaker = CircuitBreaker(max_failures=2, reset_after=0.05)
+breaker.record(False)
+assert breaker.allow()
+breaker.record(False)
+assert not breaker.allow()
+time.sleep(0.06)
+assert breaker.allow()  # 試探
+assert not breaker.allow()  # 試探進行中，其他請求仍被擋下
+breaker.record(True)
+assert breaker.allow() and breaker.failures == 0
+
+
+def make_backend(name, calls, delay=0.0, result=None, error=None):
+    def backend(text, cancel):
+        calls.append((name, time.monotonic()))
+        if delay and cancel.wait(delay):
+            return ""
+        if error:
+            raise RuntimeError(error)
+        return result or f"{name}:{text}"
+
+    return backend
+
+
+def make_translator(calls, primary, secondary, hedge_delay=0.05, timeout=1.0):
+    breakers = {"primary": CircuitBreaker(), "secondary": CircuitBreaker()}
+    backends = [
+        ("primary", make_backend("primary", calls, **primary)),
+        ("secondary", make_backend("secondary", calls, **secondary)),
+    ]
+    return HedgedTranslator(backends, hedge_delay, timeout, breakers), breakers
+
+
+# 主要後端很快：直接採用，不呼叫備援
+calls = []
+translator, _ = make_translator(calls, {}, {})
+assert translator.translate("你好") == ("primary:你好", "primary")
+assert [name for name, _ in calls] == ["primary"]
+
+# 主要後端太慢：hedge_delay 後才同時呼叫備援，採用先完成的備援
+calls = []
+translator, breakers = make_translator(calls, {"delay": 1.0}, {})
+started = time.monotonic()
+assert translator.translate("你好") == ("secondary:你好", "secondary")
+assert [name for name, _ in calls] == ["primary", "secondary"]
+assert calls[1][1] - started >= 0.05
+assert time.monotonic() - started < 0.5  # 主要後端被取消，不必等它
+assert breakers["primary"].failures == 0  # 被取消不算失敗
+
+# 主要後端失敗：不等 hedge_delay，立刻改用備援，並記錄一次失敗
+calls = []
+translator, breakers = make_translator(calls, {"error": "boom"}, {}, hedge_delay=1.0)
+started = time.monotonic()
+assert translator.translate("你好") == ("secondary:你好", "secondary")
+assert time.monotonic() - started < 0.5
+assert breakers["primary"].failures == 1
+
+# 熔斷中的後端直接略過
+calls = []
+translator, breakers = make_translator(calls, {}, {})
+breakers["primary"].opened_at = time.monotonic()
+assert translator.translate("你好") == ("secondary:你好", "secondary")
+assert [name for name, _ in calls] == ["secondary"]
+
+# 半開的備援後端沒有用到時，不會佔掉它的試探機會
+calls = []
+translator, breakers = make_translator(calls, {}, {})
+breakers["secondary"].opened_at = time.monotonic() - breakers["secondary"].reset_after
+assert translator.translate("你好") == ("primary:你好", "primary")
+assert breakers["secondary"].allow(), "備援後端的試探機會應保留"
+
+# 全部逾時：回傳 None，已開始卻沒完成的後端各算一次失敗
+calls = []
+translator, breakers = make_translator(calls, {"delay": 1.0}, {"delay": 1.0}, hedge_delay=0.02, timeout=0.1)
+assert translator.translate("你好") is None
+assert breakers["primary"].failures == 1 and breakers["secondary"].failures == 1
+print("plan_translation / join_translated / CircuitBreaker / HedgedTranslator 測試通過")
 
 f = Filter()
 
@@ -29,4 +153,7 @@ body_outlet ={
 
 # 測試outlet
 result = f.outlet(body_outlet, None)
-print("outlet 輸出:", result["messages"][-1]["content"])
\ No newline at end of file
+print("outlet 輸出:", result["messages"][-1]["content"])
+
+# 載入與第一次呼叫 Gemini 的耗時
+print("耗時:", timing_report())
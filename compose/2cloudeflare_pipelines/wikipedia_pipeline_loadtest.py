@@ -0,0 +1,216 @@
+"""
+中文維基百科 Pipeline 的並行聊天壓力測試，結果以 JSON 輸出。
+
+同時送出 N 個聊天，比較兩種執行方式：
+  sync   同步 pipe，由執行緒池處理。pipelines server 也是這樣呼叫 pipe 的
+         （預設 40 個執行緒，與 Starlette/AnyIO 執行緒池上限相同）
+  async  apipe，所有聊天在同一個事件迴圈上執行（共用 httpx.AsyncClient）
+每個聊天記錄第一個片段時間（TTFB）與完成時間。聊天數不超過 --workers 時兩者相近；
+超過時同步模式的聊天開始排隊，apipe 則不受執行緒數限制。預設聊天數（100）大於執行緒數（40），
+限流也放寬到不會觸發（結果的 throttled 應為 0），量測到的差異只來自排隊。
+
+pipelines server 只會呼叫 pipe，不會呼叫 apipe；apipe 由自行執行事件迴圈的程式直接使用
+（如本檔：先 await on_startup()，再 async for chunk in pipeline.apipe(...)）。
+
+執行方式（本檔請勿放進 pipelines volume，它不是 pipeline）：
+  python wikipedia_pipeline_loadtest.py > loadtest.json
+  python wikipedia_pipeline_loadtest.py --fake-latency 0.5   # 不連網，模擬上游延遲
+
+常用參數：
+  --chats 100            同時送出的聊天數（大於 --workers 才看得到排隊）
+  --workers 40           同步模式的執行緒數（pipelines server 的執行緒池大小）
+  --topics "台灣;日本"    每個聊天的查詢（以 ; 分隔多個主題）
+  --rate-limit 100000    每秒請求上限（預設不會觸發；改小可觀察限流的影響）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="中文維基百科 Pipeline 並行聊天壓力測試")
+    parser.add_argument("--chats", type=int, default=100, help="同時送出的聊天數（大於 --workers 才會排隊）")
+    parser.add_argument(
+        "--workers", type=int, default=40, help="同步模式的執行緒數（預設同 pipelines server 的執行緒池）"
+    )
+    parser.add_argument("--topics", default="台灣;量子力學", help="每個聊天的查詢")
+    parser.add_argument("--rate-limit", type=int, default=100_000, help="每秒請求上限（預設不會觸發）")
+    parser.add_argument("--fake-latency", type=float, help="以固定延遲模擬 MediaWiki API（秒）")
+    parser.add_argument("--modes", nargs="+", choices=("sync", "async"), default=["sync", "async"])
+    parser.add_argument("--output", help="JSON 輸出檔（預設 stdout）")
+    return parser.parse_args(argv)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """線性內插的百分位數（sorted_values 需已排序）。"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def summarize(mode: str, chats: list, wall: float) -> dict:
+    row = {"mode": mode, "chats": len(chats), "wall_s": round(wall, 3)}
+    for key in ("ttfb", "total"):
+        values = sorted(c[key] for c in chats)
+        row[f"{key}_p50_s"] = round(percentile(values, 50), 3)
+        row[f"{key}_p95_s"] = round(percentile(values, 95), 3)
+        row[f"{key}_max_s"] = round(values[-1], 3) if values else 0.0
+    row["errors"] = sum(c["error"] for c in chats)
+    print(
+        f"{mode}: {len(chats)} 個聊天 {row['wall_s']} 秒 | TTFB p50 {row['ttfb_p50_s']} 秒"
+        f" | 完成 p50 {row['total_p50_s']} / 最慢 {row['total_max_s']} 秒",
+        file=sys.stderr,
+    )
+    return row
+
+
+def fake_response(query: str) -> dict:
+    return {
+        "query": {
+            "pages": [
+                {
+                    "title": f"{query}",
+                    "index": 1,
+                    "extract": "這是模擬的摘要內容。" * 50,
+                    "fullurl": f"https://zh.wikipedia.org/wiki/{query}",
+                }
+            ]
+        }
+    }
+
+
+def install_fake(module, pipeline, latency: float):
+    """以固定延遲取代 MediaWiki API（同步 requests 與非同步 httpx 兩條路徑）。"""
+    import httpx
+
+    class FakeResponse:
+        def __init__(self, query):
+            self.query = query
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return fake_response(self.query)
+
+    def get(url, params=None, timeout=None):
+        time.sleep(latency)
+        return FakeResponse(params["gsrsearch"])
+
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json=fake_response(request.url.params["gsrsearch"]))
+
+    module.HTTP_SESSION.get = get
+    pipeline.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def chat_sync(pipeline, message: str, started: float) -> dict:
+    first = None
+    error = False
+    try:
+        for _ in pipeline.pipe(message, "wikipedia", [], {"stream": True}):
+            first = first or time.perf_counter()
+    except Exception:
+        error = True
+    end = time.perf_counter()
+    return {"ttfb": (first or end) - started, "total": end - started, "error": error}
+
+
+async def chat_async(pipeline, message: str, started: float) -> dict:
+    first = None
+    error = False
+    try:
+        async for _ in pipeline.apipe(message, "wikipedia", [], {"stream": True}):
+            first = first or time.perf_counter()
+    except Exception:
+        error = True
+    end = time.perf_counter()
+    return {"ttfb": (first or end) - started, "total": end - started, "error": error}
+
+
+def run_sync(pipeline, message: str, chats: int, workers: int) -> dict:
+    """所有聊天同時到達，由 workers 個執行緒處理（超過的聊天排隊）。"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda _: chat_sync(pipeline, message, started), range(chats)))
+    return summarize("sync", results, time.perf_counter() - started)
+
+
+async def run_async(pipeline, message: str, chats: int) -> dict:
+    """所有聊天同時到達，在同一個事件迴圈上並行處理。"""
+    started = time.perf_counter()
+    results = await asyncio.gather(*(chat_async(pipeline, message, started) for _ in range(chats)))
+    return summarize("async", results, time.perf_counter() - started)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 需在建立 Pipeline 之前設定（valves 由環境變數讀取）；關閉快取，每個聊天都打上游
+    os.environ["CACHE_PATH"] = ":memory:"
+    os.environ["CACHE_TTL"] = "0"
+    os.environ["RATE_LIMIT"] = str(args.rate_limit)
+    os.environ["RATE_BURST"] = str(args.rate_limit)
+    os.environ.setdefault("CLIENT_MODE", "api")
+
+    import wikipedia_pipeline_zh as module
+
+    pipeline = module.Pipeline()
+    results = []
+
+    def record(run):
+        # 本輪被限流延後的請求數；不為 0 表示量到的是限流而不是排隊
+        before = module.RATE_LIMITER.stats()["throttled"]
+        row = run()
+        row["throttled"] = module.RATE_LIMITER.stats()["throttled"] - before
+        results.append(row)
+
+    if "sync" in args.modes:
+        if args.fake_latency is not None:
+            install_fake(module, pipeline, args.fake_latency)
+        record(lambda: run_sync(pipeline, args.topics, args.chats, args.workers))
+    if "async" in args.modes:
+
+        async def run():
+            if args.fake_latency is not None:
+                install_fake(module, pipeline, args.fake_latency)
+            else:
+                await pipeline.on_startup()
+            try:
+                return await run_async(pipeline, args.topics, args.chats)
+            finally:
+                await pipeline.on_shutdown()
+
+        record(lambda: asyncio.run(run()))
+
+    report = {
+        "config": {
+            "chats": args.chats,
+            "workers": args.workers,
+            "topics": args.topics,
+            "client_mode": pipeline.valves.CLIENT_MODE,
+            "rate_limit": args.rate_limit,
+            "fake_latency": args.fake_latency,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,32 +4,227 @@ author: Unknown
 author_url: Unknown
 description: Wikipedia Search and Return
 required_open_webui_version: 0.4.3
-requirements: wikipedia
+requirements: wikipedia, httpx
 version: 0.4.3
 licence: MIT
 """
 
+import asyncio
+import json
 import os
+import queue
 import re
+import sqlite3
+import threading
 import time
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
-from typing import Generator, Iterator, List, Union
+from typing import AsyncGenerator, Generator, Iterator, List, Union
 
+import httpx
 import requests
 import wikipedia
 from pydantic import BaseModel, Field
+from requests.adapters import HTTPAdapter
 
 wikipedia.set_lang("zh")
 
 logger = getLogger(__name__)
 logger.setLevel("DEBUG")
 
+RE_QUERY = re.compile(r"[^0-9A-Z]", re.IGNORECASE)
+RE_ROUGH_WORD = re.compile(r"[\w]+", re.IGNORECASE)
+# a sentence or paragraph, including its closing punctuation / newlines
+RE_SENTENCE = re.compile(r"[^。！？!?.\n]*(?:[。！？!?.]+[」』”’)）]*\s*|\n+|$)")
+
+
+def iter_summary(text: str, word_limit: int) -> Generator:
+    """
+    Yield the summary sentence by sentence, cut before word number `word_limit`
+    (with "..."). Scanning stops at the limit instead of indexing the whole text.
+    """
+    words = 0
+    for match in RE_SENTENCE.finditer(text):
+        chunk = match.group()
+        if not chunk:
+            continue
+        for word in RE_ROUGH_WORD.finditer(chunk):
+            if words == word_limit:
+                yield chunk[: word.start()] + "...\n"
+                return
+            words += 1
+        yield chunk
+    yield "\n"
+
+
+class TokenBucket:
+    """
+    Process-wide token bucket, safe to share between threads and asyncio tasks.
+    Sustained `rate` acquisitions per second with bursts of up to `burst`.
+
+    Each caller reserves a token immediately (the balance may go negative) and then
+    waits out its own deficit once, so waiters are served in arrival order without
+    polling or over-sleeping.
+    """
+
+    def __init__(self, rate: float, burst: float = 1):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._stats = {"acquired": 0, "throttled": 0, "throttled_time": 0.0, "max_wait": 0.0}
+
+    def configure(self, rate: float, burst: float):
+        """Apply (possibly updated) valve values."""
+        with self._lock:
+            self._refill()
+            self.rate = max(rate, 1e-6)
+            self.burst = max(burst, 1)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self) -> float:
+        """Take one token and return how long the caller must wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            self._stats["acquired"] += 1
+            if wait:
+                self._stats["throttled"] += 1
+                self._stats["throttled_time"] += wait
+                self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+            return wait
+
+    def acquire(self):
+        """Blocking acquire for worker threads."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Non-blocking acquire for coroutines (does not stall the event loop)."""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+# one limiter per process: shared by every pipeline instance, request and topic
+RATE_LIMITER = TokenBucket(rate=5, burst=5)
+
+
+class TwoTierCache:
+    """
+    In-memory LRU in front of a SQLite table, so popular topics are served locally
+    and survive container restarts. Entries expire after `ttl` seconds; the memory
+    tier keeps `memory_entries` items and the disk tier `max_entries` (least recently
+    used rows are evicted). Falls back to memory only if the SQLite file can't be opened.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int, memory_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)"
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache: SQLite unavailable ({path}: {e}), using memory only")
+            self._db = None
+
+    @staticmethod
+    def key(kind: str, text: str) -> str:
+        return f"{kind}:{' '.join(text.lower().split())}"
+
+    def _remember(self, key: str, expires: float, value):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item and item[0] > now:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return item[1]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM cache WHERE key = ? AND expires > ?", (key, now)
+                ).fetchone()
+                if row:
+                    self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self._stats["disk_hits"] += 1
+                    return value
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value):
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self._remember(key, expires, value)
+            self._stats["sets"] += 1
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires, now),
+            )
+            # drop expired rows, then the least recently used ones above max_entries
+            evicted = self._db.execute("DELETE FROM cache WHERE expires <= ?", (now,)).rowcount
+            evicted += self._db.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._db.commit()
+            self._stats["evictions"] += evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, memory_size=len(self._memory))
+
+
+# keep-alive connections to the MediaWiki API, shared by every topic thread
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+HTTP_SESSION.headers["User-Agent"] = "open-webui-wikipedia-pipeline/0.4 (Open WebUI pipelines)"
+
+
+class RetrieveError(Exception):
+    """Markdown message to show instead of the page (disambiguation, missing page...)."""
+
 
 class Pipeline:
     class Valves(BaseModel):
         # OPENAI_API_KEY: str = Field(default="", description="OpenAI API key")
         RATE_LIMIT: int = Field(default=5, description="Rate limit for the pipeline")
+        RATE_BURST: int = Field(
+            default=5, description="Requests allowed in a burst above RATE_LIMIT"
+        )
         WORD_LIMIT: int = Field(
             default=300, description="Word limit when getting page summary"
         )
@@ -37,6 +232,27 @@ class Pipeline:
             default="https://zh.wikipedia.org/wiki",
             description="Wikipedia（中文）根網址",
         )
+        MAX_CONCURRENT_TOPICS: int = Field(
+            default=4, description="Topics (split by ';') fetched in parallel"
+        )
+        CLIENT_MODE: str = Field(
+            default="api",
+            description="api: one MediaWiki query per topic; library: the `wikipedia` package",
+        )
+        WIKIPEDIA_API: str = Field(
+            default="https://zh.wikipedia.org/w/api.php",
+            description="MediaWiki API endpoint used in api mode",
+        )
+        HTTP_TIMEOUT: float = Field(default=10, description="MediaWiki API timeout (seconds)")
+        CACHE_PATH: str = Field(
+            default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "wikipedia_cache.sqlite"),
+            description="SQLite file for cached search/page results (next to this file, i.e. the pipelines volume)",
+        )
+        CACHE_TTL: int = Field(
+            default=7 * 24 * 3600, description="Seconds before a cached result is refetched"
+        )
+        CACHE_MAX_ENTRIES: int = Field(default=5000, description="Max rows kept on disk")
+        CACHE_MEMORY_ENTRIES: int = Field(default=500, description="Max entries kept in memory")
 
     def __init__(self):
         # Optionally, you can set the id and name of the pipeline.
@@ -51,32 +267,44 @@ class Pipeline:
             **{k: os.getenv(k, v.default) for k, v in self.Valves.model_fields.items()}
         )
 
+        self.limiter = RATE_LIMITER
+        self.limiter.configure(self.valves.RATE_LIMIT, self.valves.RATE_BURST)
+
+        self.cache = TwoTierCache(
+            self.valves.CACHE_PATH,
+            ttl=self.valves.CACHE_TTL,
+            max_entries=self.valves.CACHE_MAX_ENTRIES,
+            memory_entries=self.valves.CACHE_MEMORY_ENTRIES,
+        )
+
+        # async MediaWiki client for apipe, opened in on_startup
+        self.client = None
+
     async def on_startup(self):
         # This function is called when the server is started.
         logger.debug(f"on_startup:{self.name}")
-        pass
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers=dict(HTTP_SESSION.headers),
+                timeout=self.valves.HTTP_TIMEOUT,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            )
 
     async def on_shutdown(self):
         # This function is called when the server is stopped.
         logger.debug(f"on_shutdown:{self.name}")
-        pass
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
 
-    def rate_check(self, dt_start: datetime):
-        """
-        Check time, sleep if not enough time has passed for rate
-
-        Args:
-            dt_start (datetime): Start time of the operation
-        Returns:
-            bool: True if sleep was done
-        """
-        dt_end = datetime.now()
-        time_diff = (dt_end - dt_start).total_seconds()
-        time_buffer = 1 / self.valves.RATE_LIMIT
-        if time_diff >= time_buffer:  # no need to sleep
-            return False
-        time.sleep(time_buffer - time_diff)
-        return True
+    @staticmethod
+    def is_title_request(user_message: str) -> bool:
+        # as of 12/28/24, these were standard greetings
+        # ## Create a concise, 3-5 word title with
+        # ## Task:\nGenerate 1-3 broad tags categorizing the main themes
+        return ("broad tags categorizing" in user_message.lower()) or (
+            "Create a concise" in user_message.lower()
+        )
 
     def pipe(
         self, user_message: str, model_id: str, messages: List[dict], body: dict
@@ -88,12 +316,7 @@ class Pipeline:
         logger.debug(f"pipe:{self.name}")
 
         # Check if title generation is requested
-        # as of 12/28/24, these were standard greetings
-        if ("broad tags categorizing" in user_message.lower()) or (
-            "Create a concise" in user_message.lower()
-        ):
-            # ## Create a concise, 3-5 word title with
-            # ## Task:\nGenerate 1-3 broad tags categorizing the main themes
+        if self.is_title_request(user_message):
             logger.debug(f"Title Generation (aborted): {user_message}")
             return "(title generation disabled)"
 
@@ -107,121 +330,307 @@ class Pipeline:
         #   'user': {'name': 'User', 'id': '235a828f-84a3-44a0-b7af-721ee8be6571',
         #            'email': 'admin@localhost', 'role': 'admin'}}
 
-        dt_start = datetime.now()
-        multi_part = False
+        # valves may have been changed from the Open WebUI admin panel
+        self.limiter.configure(self.valves.RATE_LIMIT, self.valves.RATE_BURST)
         streaming = body.get("stream", False)
         logger.warning(f"Stream: {streaming}")
         context = ""
 
         # examples from https://pypi.org/project/wikipedia/
         # new addition - ability to include multiple topics with a semicolon
-        for query in user_message.split(";"):
-            self.rate_check(dt_start)
-            query = query.strip()
-
-            if multi_part:
-                if streaming:
-                    yield "---\n"
-                else:
-                    context += "---\n"
-            if body.get("stream", True):
-                yield from self.stream_retrieve(query, dt_start)
-            else:
-                for chunk in self.stream_retrieve(query, dt_start):
-                    context += chunk
-            multi_part = True
+        queries = [query.strip() for query in user_message.split(";")]
+
+        # fetch all topics concurrently (rate limited by the shared token bucket);
+        # each topic streams into its own queue, emitted in the original order and
+        # flushed chunk by chunk while the current topic is still being produced
+        def produce(query, chunks):
+            try:
+                for chunk in self.stream_retrieve(query):
+                    chunks.put(chunk)
+            finally:
+                chunks.put(None)
+
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(len(queries), self.valves.MAX_CONCURRENT_TOPICS))
+        )
+        try:
+            topics = []
+            for query in queries:
+                chunks = queue.Queue()
+                topics.append((executor.submit(produce, query, chunks), chunks))
+            for i, (future, chunks) in enumerate(topics):
+                if i:
+                    if streaming:
+                        yield "---\n"
+                    else:
+                        context += "---\n"
+                for chunk in iter(chunks.get, None):
+                    if body.get("stream", True):
+                        yield chunk
+                    else:
+                        context += chunk
+                future.result()  # re-raise a failure of this topic
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.debug(f"Rate limiter: {self.limiter.stats()}")
+            logger.debug(f"Cache: {self.cache.stats()}")
 
         if not streaming:
             return context if context else "No information found"
 
-    def stream_retrieve(
-        self,
-        query: str,
-        dt_start: datetime,
-    ) -> Generator:
+    async def apipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> AsyncGenerator:
+        """
+        Async-native variant of `pipe`: every topic is a task on the event loop using the
+        shared httpx.AsyncClient, so one worker can serve many chats at once instead of
+        holding a thread per chat. Always yields chunks (join them for a single response).
+
+        The pipelines server only calls `pipe` (from its thread pool), so this is not used
+        there. Callers that run their own event loop drive it directly:
+        `async for chunk in pipeline.apipe(...)`, after `await pipeline.on_startup()`
+        (see wikipedia_pipeline_loadtest.py).
+        """
+        logger.debug(f"apipe:{self.name}")
+        if self.is_title_request(user_message):
+            logger.debug(f"Title Generation (aborted): {user_message}")
+            yield "(title generation disabled)"
+            return
+
+        logger.info(f"User Message: {user_message}")
+        if self.client is None:
+            await self.on_startup()
+        self.limiter.configure(self.valves.RATE_LIMIT, self.valves.RATE_BURST)
+        queries = [query.strip() for query in user_message.split(";")]
+        semaphore = asyncio.Semaphore(max(1, self.valves.MAX_CONCURRENT_TOPICS))
+
+        # same ordering as pipe: one queue per topic, flushed in order
+        async def produce(query, chunks):
+            try:
+                async with semaphore:
+                    async for chunk in self.astream_retrieve(query):
+                        await chunks.put(chunk)
+            finally:
+                await chunks.put(None)
+
+        topics = []
+        for query in queries:
+            chunks = asyncio.Queue()
+            topics.append((asyncio.create_task(produce(query, chunks)), chunks))
+        try:
+            for i, (task, chunks) in enumerate(topics):
+                if i:
+                    yield "---\n"
+                while (chunk := await chunks.get()) is not None:
+                    yield chunk
+                await task  # re-raise a failure of this topic
+        finally:
+            for task, _ in topics:
+                task.cancel()
+            logger.debug(f"Rate limiter: {self.limiter.stats()}")
+            logger.debug(f"Cache: {self.cache.stats()}")
+
+    def stream_retrieve(self, query: str) -> Generator:
         """
         Retrieve the wikipedia page for the query and return the summary.  Return a generator
         for streaming responses but can also be iterated for a single response.
         """
 
-        re_query = re.compile(r"[^0-9A-Z]", re.IGNORECASE)
-        re_rough_word = re.compile(r"[\w]+", re.IGNORECASE)
+        titles_found, page = self.cached(query)
+        if page is None:
+            fetch = self.fetch_library if self.valves.CLIENT_MODE == "library" else self.fetch_api
+            try:
+                titles_found, page = fetch(query, titles_found)
+            except RetrieveError as e:
+                yield str(e) + "\n"
+                return
+            self.store(query, titles_found, page)
 
-        titles_found = None
-        try:
-            titles_found = wikipedia.search(query)
-            # r = requests.get(
-            #     f"https://en.wikipedia.org/w/api.php?action=opensearch&search={query}&limit=1&namespace=0&format=json"
-            # )
-            logger.info(f"Query: {query}, Found: {titles_found}")
-        except Exception as e:
-            logger.error(f"Search Error: {query} -> {e}")
-            yield f"Page Search Error: {query}"
+        yield from self.render(query, titles_found, page)
 
-        if titles_found is None or not titles_found:  # no results
+    async def astream_retrieve(self, query: str) -> AsyncGenerator:
+        """
+        Async counterpart of `stream_retrieve`. Cache lookups/writes (SQLite) and the
+        library mode run in a thread so they never block the event loop.
+        """
+        titles_found, page = await asyncio.to_thread(self.cached, query)
+        if page is None:
+            try:
+                if self.valves.CLIENT_MODE == "library":
+                    titles_found, page = await asyncio.to_thread(
+                        self.fetch_library, query, titles_found
+                    )
+                else:
+                    titles_found, page = await self.afetch_api(query)
+            except RetrieveError as e:
+                yield str(e) + "\n"
+                return
+            await asyncio.to_thread(self.store, query, titles_found, page)
+
+        for chunk in self.render(query, titles_found, page):
+            yield chunk
+
+    def cached(self, query: str) -> tuple:
+        """(titles, page) from the cache; page is None unless both entries are cached."""
+        titles_found = self.cache.get(self.cache.key("search", query))
+        page = self.cache.get(self.cache.key("page", titles_found[0])) if titles_found else None
+        return titles_found, page
+
+    def store(self, query: str, titles_found: list, page: dict):
+        if titles_found:
+            self.cache.set(self.cache.key("search", query), titles_found)
+        if page:
+            self.cache.set(self.cache.key("page", titles_found[0]), page)
+
+    def render(self, query: str, titles_found: list, page: dict) -> Generator:
+        """Markdown chunks for a retrieved page: title, summary, links and image."""
+        if not titles_found:  # no results
             yield f"No information found for '{query}'"
             return
 
-        self.rate_check(dt_start)
-
-        # if context: # add separator if multiple topics
-        #     context += "---\n"
-        try:
-            title_check = titles_found[0]
-            wiki_page = wikipedia.page(
-                title_check, auto_suggest=False
-            )  # trick! don't auto-suggest
-        except wikipedia.exceptions.DisambiguationError as e:
-            str_error = str(e).replace("\n", ", ")
-            str_error = f"## Disambiguation Error ({query})\n* Status: {str_error}"
-            logger.error(str_error)
-            yield str_error + "\n"
-            return
-        except wikipedia.exceptions.RedirectError as e:
-            str_error = str(e).replace("\n", ", ")
-            str_error = f"## Redirect Error ({query})\n* Status: {str_error}"
-            logger.error(str_error)
-            yield str_error + "\n"
-            return
-        except Exception as e:
-            if titles_found:
-                str_error = f"## Page Retrieve Error ({query})\n* Found Topics (matched '{title_check}') {titles_found}"
-                logger.error(f"{str_error} -> {e}")
-            else:
-                str_error = f"## Page Not Found ({query})\n* Unknown error"
-                logger.error(f"{str_error} -> {e}")
-            yield str_error + "\n"
-            return
-
-        # found a page / section
-        logger.info(f"Page Sections[{query}]: {wiki_page.sections}")
+        title_check = titles_found[0]
         yield f"## {title_check}\n"
 
         # flatten internal links
-        # link_md = [f"[{x}]({self.valves.WIKIPEDIA_ROOT}/{re_query.sub('_', x)})" for x in wiki_page.links[:10]]
+        # link_md = [f"[{x}]({self.valves.WIKIPEDIA_ROOT}/{RE_QUERY.sub('_', x)})" for x in wiki_page.links[:10]]
         # yield "* Links (first 30): " + ",".join(link_md) + "\n"
 
-        # add the textual summary
-        summary_full = wiki_page.summary
-        word_positions = [x.start() for x in re_rough_word.finditer(summary_full)]
-        if len(word_positions) > self.valves.WORD_LIMIT:
-            yield summary_full[: word_positions[self.valves.WORD_LIMIT]] + "...\n"
-        else:
-            yield summary_full + "\n"
+        # add the textual summary, one sentence at a time
+        yield from iter_summary(page["summary"], self.valves.WORD_LIMIT)
 
         # the more you know! link to further reading
         yield "### Learn More" + "\n"
-        yield f"* [Read more on Wikipedia...]({wiki_page.url})\n"
+        yield f"* [Read more on Wikipedia...]({page['url']})\n"
 
         # also spit out the related topics from search
         link_md = [
-            f"[{x}]({self.valves.WIKIPEDIA_ROOT}/{re_query.sub('_', x)})"
+            f"[{x}]({self.valves.WIKIPEDIA_ROOT}/{RE_QUERY.sub('_', x)})"
             for x in titles_found
         ]
         yield f"* Related topics: {', '.join(link_md)}\n"
 
         # throw in the first image for good measure
-        if wiki_page.images:
-            yield f"\n![Image: {title_check}]({wiki_page.images[0]})\n"
+        if page["image"]:
+            yield f"\n![Image: {title_check}]({page['image']})\n"
 
         return
+
+    def api_params(self, query: str) -> dict:
+        """
+        One MediaWiki request per topic: the search hits (generator=search) together with
+        the intro extract, canonical URL and lead image of each hit.
+        """
+        return {
+            "action": "query",
+            "format": "json",
+            "formatversion": 2,
+            "generator": "search",
+            "gsrsearch": query,
+            "gsrnamespace": 0,
+            "gsrlimit": 10,
+            "prop": "extracts|pageimages|info|pageprops",
+            "exintro": 1,
+            "explaintext": 1,
+            "exlimit": "max",
+            "piprop": "original",
+            "pilicense": "any",
+            "inprop": "url",
+            "ppprop": "disambiguation",
+        }
+
+    def parse_api(self, query: str, data: dict) -> tuple:
+        """(titles, page) from an `api_params` response."""
+        # pages come back in pageid order; "index" is the search rank
+        pages = sorted(data.get("query", {}).get("pages", []), key=lambda x: x.get("index", 0))
+        titles_found = [x["title"] for x in pages]
+        logger.info(f"Query: {query}, Found: {titles_found}")
+        if not pages:
+            return titles_found, None
+
+        top = pages[0]
+        if "disambiguation" in top.get("pageprops", {}):
+            str_error = f"## Disambiguation Error ({query})\n* Status: \"{top['title']}\" may refer to: {', '.join(titles_found[1:])}"
+            logger.error(str_error)
+            raise RetrieveError(str_error)
+        return titles_found, {
+            "summary": top.get("extract", ""),
+            "url": top.get("fullurl") or f"{self.valves.WIKIPEDIA_ROOT}/{top['title']}",
+            "image": top.get("original", {}).get("source"),
+        }
+
+    def fetch_api(self, query: str, titles_found: list = None) -> tuple:
+        """Single MediaWiki query over the pooled requests.Session. Returns (titles, page)."""
+        self.limiter.acquire()
+        try:
+            r = HTTP_SESSION.get(
+                self.valves.WIKIPEDIA_API,
+                params=self.api_params(query),
+                timeout=self.valves.HTTP_TIMEOUT,
+            )
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            logger.error(f"Search Error: {query} -> {e}")
+            raise RetrieveError(f"Page Search Error: {query}")
+        return self.parse_api(query, data)
+
+    async def afetch_api(self, query: str) -> tuple:
+        """Single MediaWiki query over the shared httpx.AsyncClient. Returns (titles, page)."""
+        await self.limiter.acquire_async()
+        try:
+            r = await self.client.get(self.valves.WIKIPEDIA_API, params=self.api_params(query))
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            logger.error(f"Search Error: {query} -> {e}")
+            raise RetrieveError(f"Page Search Error: {query}")
+        return self.parse_api(query, data)
+
+    def fetch_library(self, query: str, titles_found: list = None) -> tuple:
+        """
+        The `wikipedia` package: search, then page (summary, url, images each load lazily).
+        Returns (titles, page).
+        """
+        if titles_found is None:
+            try:
+                self.limiter.acquire()
+                titles_found = wikipedia.search(query)
+                # r = requests.get(
+                #     f"https://en.wikipedia.org/w/api.php?action=opensearch&search={query}&limit=1&namespace=0&format=json"
+                # )
+                logger.info(f"Query: {query}, Found: {titles_found}")
+            except Exception as e:
+                logger.error(f"Search Error: {query} -> {e}")
+                raise RetrieveError(f"Page Search Error: {query}")
+        if not titles_found:
+            return titles_found, None
+
+        title_check = titles_found[0]
+        self.limiter.acquire()
+        try:
+            wiki_page = wikipedia.page(
+                title_check, auto_suggest=False
+            )  # trick! don't auto-suggest
+        except wikipedia.exceptions.DisambiguationError as e:
+            str_error = str(e).replace("\n", ", ")
+            str_error = f"## Disambiguation Error ({query})\n* Status: {str_error}"
+            logger.error(str_error)
+            raise RetrieveError(str_error)
+        except wikipedia.exceptions.RedirectError as e:
+            str_error = str(e).replace("\n", ", ")
+            str_error = f"## Redirect Error ({query})\n* Status: {str_error}"
+            logger.error(str_error)
+            raise RetrieveError(str_error)
+        except Exception as e:
+            str_error = f"## Page Retrieve Error ({query})\n* Found Topics (matched '{title_check}') {titles_found}"
+            logger.error(f"{str_error} -> {e}")
+            raise RetrieveError(str_error)
+
+        # found a page / section
+        logger.info(f"Page Sections[{query}]: {wiki_page.sections}")
+        images = wiki_page.images
+        return titles_found, {
+            "summary": wiki_page.summary,
+            "url": wiki_page.url,
+            "image": images[0] if images else None,
+        }
@@ -1,8 +1,18 @@
+import asyncio
+import math
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
+
 import requests
+from requests.adapters import HTTPAdapter
 from mcp.server.fastmcp import FastMCP
 
-mcp = FastMCP("Custom Tools")
-
 # Mapping of city to coordinates
 CITY_MAP = {
     "台北": (25.0330, 121.5654),
@@ -25,12 +35,280 @@ CITY_MAP = {
     "台東": (22.9975, 121.5594),
     "澎湖": (23.3576, 120.4531),
     "金門": (24.4399, 118.5882),
-    "連江": (22.7723, 118.2144),
+    "連江": (26.1600, 119.9500),
 }
 
 # Tuple of supported city names for quick reference
 CITY_NAMES = tuple(CITY_MAP.keys())
 
+# English / pinyin names (and common nicknames) for each city
+CITY_ALIASES = {
+    "台北": ("Taipei", "Taibei"),
+    "新北": ("New Taipei", "Xinbei"),
+    "桃園": ("Taoyuan",),
+    "台中": ("Taichung", "Taizhong"),
+    "台南": ("Tainan",),
+    "高雄": ("Kaohsiung", "Gaoxiong"),
+    "基隆": ("Keelung", "Jilong"),
+    "新竹": ("Hsinchu", "Xinzhu"),
+    "嘉義": ("Chiayi", "Chiayi City", "Jiayi", "Jiayi City"),
+    "宜蘭": ("Yilan", "Ilan"),
+    "苗栗": ("Miaoli",),
+    "南投": ("Nantou",),
+    "彰化": ("Changhua", "Zhanghua"),
+    "雲林": ("Yunlin",),
+    "嘉義縣": ("Chiayi County", "Jiayi County"),
+    "屏東": ("Pingtung", "Pingdong"),
+    "花蓮": ("Hualien", "Hualian"),
+    "台東": ("Taitung", "Taidong"),
+    "澎湖": ("Penghu",),
+    "金門": ("Kinmen", "Jinmen"),
+    "連江": ("Lienchiang", "Lianjiang", "Matsu", "馬祖"),
+}
+
+# Simplified -> traditional characters used in city names (臺 is normalised to 台)
+_CHAR_VARIANTS = str.maketrans({
+    "臺": "台", "园": "園", "义": "義", "兰": "蘭", "云": "雲", "东": "東",
+    "莲": "蓮", "门": "門", "连": "連", "县": "縣", "马": "馬",
+})
+_CITY_SUFFIXES = ("市", "縣", "city", "county")
+_COORDS_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+NEAREST_CITY_MAX_KM = 150
+
+
+def _normalize_city(name: str) -> str:
+    return re.sub(r"[\s\-_]", "", name.translate(_CHAR_VARIANTS).lower())
+
+
+def _build_city_index() -> dict:
+    """預先建立「正規化名稱 -> CITY_MAP 鍵」索引；原名優先於別名與加上 市/縣 的寫法。"""
+    index = {_normalize_city(city): city for city in CITY_MAP}
+    for city, aliases in CITY_ALIASES.items():
+        for alias in aliases:
+            index.setdefault(_normalize_city(alias), city)
+    for key, city in list(index.items()):
+        for suffix in _CITY_SUFFIXES:
+            index.setdefault(key + suffix, city)
+    return index
+
+
+CITY_INDEX = _build_city_index()
+
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+
+def nearest_city(lat: float, lon: float):
+    """回傳距離座標最近的城市；超過 NEAREST_CITY_MAX_KM 公里則回傳 None。"""
+    city = min(CITY_MAP, key=lambda c: _distance_km(lat, lon, *CITY_MAP[c]))
+    if _distance_km(lat, lon, *CITY_MAP[city]) > NEAREST_CITY_MAX_KM:
+        return None
+    return city
+
+
+def resolve_city(name: str):
+    """
+    把使用者輸入對應到 CITY_MAP 的鍵：原名、臺/台、簡體、英文、拼音，可帶 市/縣 字尾；
+    或「緯度,經度」字串（取最近的城市）。無法對應時回傳 None。
+    """
+    if name in CITY_MAP:
+        return name
+    match = _COORDS_RE.match(name)
+    if match:
+        return nearest_city(float(match.group(1)), float(match.group(2)))
+    key = _normalize_city(name)
+    if key in CITY_INDEX:
+        return CITY_INDEX[key]
+    for suffix in _CITY_SUFFIXES:
+        if key.endswith(suffix) and key[: -len(suffix)] in CITY_INDEX:
+            return CITY_INDEX[key[: -len(suffix)]]
+    return None
+
+
+# ========== 天氣快取設定 ==========
+# Open-Meteo 的 current_weather 約每 15 分鐘更新一次
+WEATHER_CONFIG = {
+    "ttl": float(os.environ.get("WEATHER_TTL", "900")),  # 秒數內直接回傳快取
+    "stale_ttl": float(os.environ.get("WEATHER_STALE_TTL", "3600")),  # 過期但在此秒數內：先回舊資料，背景更新
+    "timeout": float(os.environ.get("WEATHER_TIMEOUT", "10")),
+    # 1：背景每隔 prefetch_interval 秒（±10% 隨機）一次抓取所有城市，get_weather 直接由記憶體回覆
+    "prefetch": os.environ.get("WEATHER_PREFETCH", "0") == "1",
+    "prefetch_interval": float(os.environ.get("WEATHER_PREFETCH_INTERVAL", "600")),
+}
+# 回覆中的資料時間以台灣時間顯示（容器內預設為 UTC；台灣不實施日光節約時間）
+LOCAL_TZ = timezone(timedelta(hours=8))
+
+# 共用 keep-alive 連線
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+
+_lock = threading.Lock()
+_cache = {}  # city -> (取得時間 monotonic, current_weather dict, 取得時間 datetime)
+_inflight = {}  # city -> Future，同一城市同時只發一個上游請求
+_stats = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "upstream_calls": 0,
+    "upstream_errors": 0,
+    "upstream_time": 0.0,
+    "upstream_max": 0.0,
+}
+_prefetch_state = {"last_success": None, "last_error": None, "failures": 0}
+PREFETCH_PENDING = "天氣資料尚未載入（背景抓取中），請稍後再試"
+PREFETCH_STALE = "天氣資料過久未更新（背景抓取失敗），請稍後再試"
+
+
+def _format_time(dt: datetime) -> str:
+    return f"{dt:%Y-%m-%d %H:%M:%S %Z}"
+
+
+def _upstream_get(latitude: str, longitude: str):
+    """呼叫 Open-Meteo（經緯度可為逗號分隔的多個座標），並記錄延遲與失敗次數。"""
+    url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current_weather=true"
+    start = time.perf_counter()
+    try:
+        response = _session.get(url, timeout=WEATHER_CONFIG["timeout"])
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        with _lock:
+            _stats["upstream_errors"] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _stats["upstream_calls"] += 1
+            _stats["upstream_time"] += elapsed
+            _stats["upstream_max"] = max(_stats["upstream_max"], elapsed)
+
+
+def _fetch_upstream(city: str) -> tuple:
+    """呼叫 Open-Meteo 取得 current_weather，成功後寫入快取並回傳快取項目。"""
+    lat, lon = CITY_MAP[city]
+    weather = _upstream_get(lat, lon).get("current_weather", {})
+    entry = (time.monotonic(), weather, datetime.now(LOCAL_TZ))
+    with _lock:
+        _cache[city] = entry
+    return entry
+
+
+def _fetch_upstream_many(cities: list) -> dict:
+    """一次請求取得多個城市的 current_weather（Open-Meteo 多座標查詢回傳 list），寫入快取。"""
+    latitude = ",".join(str(CITY_MAP[c][0]) for c in cities)
+    longitude = ",".join(str(CITY_MAP[c][1]) for c in cities)
+    data = _upstream_get(latitude, longitude)
+    if isinstance(data, dict):  # 只有一個座標時回傳單一物件
+        data = [data]
+    now, fetched_at = time.monotonic(), datetime.now(LOCAL_TZ)
+    result = {city: item.get("current_weather", {}) for city, item in zip(cities, data)}
+    with _lock:
+        for city, weather in result.items():
+            _cache[city] = (now, weather, fetched_at)
+    return result
+
+
+def _start_refresh(city: str):
+    """
+    取得該城市進行中的請求；沒有的話建立一個。
+    回傳 (future, 是否由呼叫者負責執行)。
+    """
+    with _lock:
+        future = _inflight.get(city)
+        if future is not None:
+            return future, False
+        future = Future()
+        _inflight[city] = future
+    return future, True
+
+
+def _run_refresh(city: str, future: Future):
+    try:
+        future.set_result(_fetch_upstream(city))
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _lock:
+            _inflight.pop(city, None)
+
+
+def _get_current_weather(city: str) -> tuple:
+    """
+    取得城市的快取項目 (monotonic, current_weather, 取得時間)：
+    - 快取未過期：直接回傳
+    - 已過期但未超過 stale_ttl：回傳舊資料，背景更新（呼叫者不等待）
+    - 沒有可用快取：呼叫上游；同時查詢同一城市的請求共用同一次呼叫
+    背景預先抓取時只讀記憶體（超過 stale_ttl 的資料不回傳），更新交給 _prefetch_loop。
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(city)
+        if WEATHER_CONFIG["prefetch"]:
+            if entry is None or now - entry[0] >= WEATHER_CONFIG["stale_ttl"]:
+                _stats["misses"] += 1
+                raise LookupError(PREFETCH_PENDING if entry is None else PREFETCH_STALE)
+            _stats["hits" if now - entry[0] < WEATHER_CONFIG["ttl"] else "stale_hits"] += 1
+            return entry
+    if entry is not None:
+        age = now - entry[0]
+        if age < WEATHER_CONFIG["ttl"]:
+            with _lock:
+                _stats["hits"] += 1
+            return entry
+        if age < WEATHER_CONFIG["stale_ttl"]:
+            with _lock:
+                _stats["stale_hits"] += 1
+            future, owner = _start_refresh(city)
+            if owner:
+                threading.Thread(target=_run_refresh, args=(city, future), daemon=True).start()
+            return entry
+
+    future, owner = _start_refresh(city)
+    with _lock:
+        _stats["misses" if owner else "coalesced"] += 1
+    if owner:
+        _run_refresh(city, future)
+    return future.result()
+
+
+async def _prefetch_loop():
+    """
+    背景一次抓取所有城市（單一請求）。成功後間隔 prefetch_interval ±10%；
+    失敗時從 5 秒開始指數退避（上限 prefetch_interval），期間 get_weather 繼續回覆舊資料（最多 stale_ttl 秒）。
+    """
+    interval = WEATHER_CONFIG["prefetch_interval"]
+    while True:
+        try:
+            await asyncio.to_thread(_fetch_upstream_many, list(CITY_NAMES))
+            _prefetch_state["last_success"] = datetime.now(LOCAL_TZ)
+            _prefetch_state["failures"] = 0
+            delay = interval * random.uniform(0.9, 1.1)
+        except Exception as e:
+            _prefetch_state["last_error"] = f"{_format_time(datetime.now(LOCAL_TZ))} {e}"
+            _prefetch_state["failures"] += 1
+            delay = min(interval, 5 * 2 ** (_prefetch_state["failures"] - 1)) * random.uniform(0.5, 1.0)
+        await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def lifespan(server):
+    """MCP server 啟動時（WEATHER_PREFETCH=1）開始背景預先抓取所有城市天氣，關閉時停止。"""
+    task = asyncio.create_task(_prefetch_loop()) if WEATHER_CONFIG["prefetch"] else None
+    try:
+        yield
+    finally:
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+
+mcp = FastMCP("Custom Tools", lifespan=lifespan)
+
 
 @mcp.tool()
 def get_weather(city: str) -> str:
@@ -39,25 +317,113 @@ def get_weather(city: str) -> str:
     參數 `city`：要查詢的城市名稱，應為台灣內部城市之一。
     支援的城市列表可從 `CITY_NAMES` 取得。
     支援城市: 台北, 新北, 桃園, 台中, 台南, 高雄, 基隆, 新竹, 嘉義, 宜蘭, 苗栗, 南投, 彰化, 雲林, 嘉義縣, 屏東, 花蓮, 台東, 澎湖, 金門, 連江
+    也接受 臺北、台北市、Taipei 等寫法，或「緯度,經度」（取最近的城市）。
     """
-    if city not in CITY_MAP:
+    resolved = resolve_city(city)
+    if resolved is None:
         return f"不支援的城市:{city},只支援台灣的城市"
-
-    lat, lon = CITY_MAP[city]
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
+    city = resolved
 
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        weather = data.get("current_weather", {})
+        _, weather, fetched_at = _get_current_weather(city)
         temperature = weather.get("temperature", "N/A")
         desc = weather.get("weathercode", 0)
-        return f"{city}目前氣溫約{temperature}°C,天氣代碼{desc}"
+        reply = f"{city}目前氣溫約{temperature}°C,天氣代碼{desc}"
+        if WEATHER_CONFIG["prefetch"]:
+            reply += f",資料更新於{_format_time(fetched_at)}"
+        return reply
     except Exception as e:
         return f"查詢失敗:{e}"
 
-    return f"Weather for {city}"
+
+def _weather_table(cities: list) -> str:
+    """未過期的城市直接用快取，其餘城市合併成一次上游請求，回傳精簡表格。"""
+    resolved = [(c, resolve_city(c)) for c in cities]
+    unsupported = [c for c, r in resolved if r is None]
+    cities = list(dict.fromkeys(r for _, r in resolved if r is not None))
+
+    # 背景預先抓取時只讀記憶體（stale_ttl 內的資料），更新交給 _prefetch_loop
+    max_age = WEATHER_CONFIG["stale_ttl"] if WEATHER_CONFIG["prefetch"] else WEATHER_CONFIG["ttl"]
+    now = time.monotonic()
+    weathers = {}
+    oldest = datetime.now(LOCAL_TZ)
+    with _lock:
+        for city in cities:
+            entry = _cache.get(city)
+            if entry is not None and now - entry[0] < max_age:
+                weathers[city] = entry[1]
+                oldest = min(oldest, entry[2])
+        missing = [c for c in cities if c not in weathers]
+        never_fetched = any(c not in _cache for c in missing)
+        _stats["hits"] += len(weathers)
+        _stats["misses"] += len(missing)
+
+    if missing and WEATHER_CONFIG["prefetch"]:
+        return f"查詢失敗:{PREFETCH_PENDING if never_fetched else PREFETCH_STALE}"
+    if missing:
+        try:
+            weathers.update(_fetch_upstream_many(missing))
+        except Exception as e:
+            return f"查詢失敗:{e}"
+
+    lines = ["城市 | 氣溫(°C) | 天氣代碼"]
+    for city in cities:
+        weather = weathers.get(city, {})
+        lines.append(f"{city} | {weather.get('temperature', 'N/A')} | {weather.get('weathercode', 0)}")
+    if unsupported:
+        lines.append(f"不支援的城市:{', '.join(unsupported)},只支援台灣的城市")
+    if WEATHER_CONFIG["prefetch"]:
+        lines.append(f"資料更新於{_format_time(oldest)}")
+    return "\n".join(lines)
+
+
+@mcp.tool()
+def get_weather_many(cities: list[str]) -> str:
+    """
+    一次查詢多個城市的天氣概況（單一請求），回傳表格：城市 | 氣溫 | 天氣代碼。
+    參數 `cities`：城市名稱列表，例如 ["台北", "新北", "基隆", "桃園"]。
+    支援城市: 台北, 新北, 桃園, 台中, 台南, 高雄, 基隆, 新竹, 嘉義, 宜蘭, 苗栗, 南投, 彰化, 雲林, 嘉義縣, 屏東, 花蓮, 台東, 澎湖, 金門, 連江
+    """
+    return _weather_table(cities)
+
+
+@mcp.tool()
+def get_weather_all() -> str:
+    """
+    一次查詢所有支援城市（台灣各縣市）的天氣概況，回傳表格：城市 | 氣溫 | 天氣代碼。
+    """
+    return _weather_table(list(CITY_NAMES))
+
+
+@mcp.tool()
+def get_weather_stats() -> str:
+    """
+    查看天氣查詢的快取命中率與 Open-Meteo 上游延遲統計。
+    """
+    with _lock:
+        s = dict(_stats)
+        cached_cities = len(_cache)
+    lookups = s["hits"] + s["stale_hits"] + s["misses"] + s["coalesced"]
+    hit_ratio = (s["hits"] + s["stale_hits"]) / lookups * 100 if lookups else 0.0
+    avg_ms = s["upstream_time"] / s["upstream_calls"] * 1000 if s["upstream_calls"] else 0.0
+    text = (
+        f"天氣快取（TTL {WEATHER_CONFIG['ttl']:g} 秒，舊資料可用 {WEATHER_CONFIG['stale_ttl']:g} 秒）:\n"
+        f"  已快取城市: {cached_cities}\n"
+        f"  命中: {s['hits']} | 舊資料命中: {s['stale_hits']} | 未命中: {s['misses']} | 合併請求: {s['coalesced']}\n"
+        f"  命中率: {hit_ratio:.1f}%\n"
+        f"  上游呼叫: {s['upstream_calls']} | 失敗: {s['upstream_errors']}"
+        f" | 平均延遲: {avg_ms:.0f} ms | 最大延遲: {s['upstream_max'] * 1000:.0f} ms"
+    )
+    if WEATHER_CONFIG["prefetch"]:
+        last = _prefetch_state["last_success"]
+        text += (
+            f"\n  背景預先抓取: 每 {WEATHER_CONFIG['prefetch_interval']:g} 秒"
+            f" | 最近成功: {_format_time(last) if last else '尚未'}"
+            f" | 連續失敗: {_prefetch_state['failures']}"
+        )
+        if _prefetch_state["failures"]:
+            text += f" | 最近錯誤: {_prefetch_state['last_error']}"
+    return text
 
 
 if __name__ == "__main__":
@@ -1,3 +1,14 @@
-from tools import get_weather
+from tools import get_weather, get_weather_all, get_weather_many, get_weather_stats
 
 print(get_weather(city="台北"))
+print(get_weather(city="台北"))  # 第二次應由快取回傳
+print(get_weather_many(cities=["台北", "新北", "基隆", "桃園"]))
+print(get_weather_all())
+print(get_weather_stats())
+
+# 別名與座標對應（不需網路）
+from tools import resolve_city
+
+for name, expected in [("臺北", "台北"), ("Taipei", "台北"), ("新竹縣", "新竹"), ("嘉義縣", "嘉義縣"), ("25.04,121.55", "台北"), ("26.16,119.95", "連江")]:
+    assert resolve_city(name) == expected, f"{name} 應對應 {expected}，得到 {resolve_city(name)}"
+print("✓ 城市別名對應正常")
@@ -0,0 +1,234 @@
+"""
+把 COVID-19 資料（CSV 或 Parquet）大量匯入 PostgreSQL 的 world 資料表。
+
+使用 COPY FROM STDIN 分批寫入暫存表，再依（國家, 日期）更新或新增到 world，
+比逐筆 INSERT 快很多。欄位對應依 tools.py 的 SCHEMA：
+來源欄位可以是中文欄名（國家、日期…）、SCHEMA 的英文鍵（country、date…）
+或 OWID 資料集的欄名（location、total_cases、total_deaths）。
+
+執行方式：
+  docker compose run --rm -v $PWD/data:/data postgres-mcp python loader.py /data/owid-covid-data.csv
+  python loader.py owid-covid-data.parquet --chunk-rows 100000
+  python loader.py data.csv --map 國家=Country --map 總確診數=Confirmed
+
+匯入完成後會 ANALYZE world，並重新整理 world_summary（若已建立）。
+"""
+
+import argparse
+import csv
+import io
+import sys
+import time
+
+from tools import SCHEMA, _q, get_connection
+
+# OWID（Our World in Data）資料集的欄名
+OWID_ALIASES = {
+    "country": "location",
+    "date": "date",
+    "confirmed": "total_cases",
+    "deaths": "total_deaths",
+}
+
+DATA_KEYS = ("country", "date", "confirmed", "deaths", "recovered")
+COUNT_KEYS = ("confirmed", "deaths", "recovered")
+
+
+def resolve_columns(header: list, overrides: dict) -> dict:
+    """
+    回傳 {SCHEMA 鍵: 來源欄名}。
+    overrides 為 {中文欄名: 來源欄名}（來自 --map）。國家與日期必須找得到。
+    """
+    mapping = {}
+    for key in DATA_KEYS:
+        column = SCHEMA.get(key)
+        if not column:
+            continue
+        if column in overrides:
+            mapping[key] = overrides[column]
+            continue
+        for candidate in (column, key, OWID_ALIASES.get(key)):
+            if candidate and candidate in header:
+                mapping[key] = candidate
+                break
+    missing = [SCHEMA[k] for k in ("country", "date") if k not in mapping]
+    if missing:
+        raise ValueError(f"來源檔案找不到欄位 {missing}，請用 --map 指定，例如 --map 國家=location")
+    return mapping
+
+
+def _count(value):
+    """OWID 的數值常是 '1234.0'，轉成整數字串；空值為 None（COPY 視為 NULL）。"""
+    if value is None or value == "":
+        return None
+    return str(int(float(value)))
+
+
+def iter_csv(path: str, chunk_rows: int):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames or []
+        yield header
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def iter_parquet(path: str, chunk_rows: int):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("讀取 Parquet 需要 pyarrow：pip install pyarrow")
+
+    parquet = pq.ParquetFile(path)
+    yield parquet.schema_arrow.names
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        yield [
+            {k: (None if v is None else str(v)) for k, v in row.items()}
+            for row in batch.to_pylist()
+        ]
+
+
+def _chunk_to_csv(rows: list, mapping: dict) -> io.StringIO:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        values = []
+        for key, source in mapping.items():
+            value = row.get(source)
+            values.append(_count(value) if key in COUNT_KEYS else (value or None))
+        writer.writerow(values)
+    buf.seek(0)
+    return buf
+
+
+def load(path: str, fmt: str = "csv", chunk_rows: int = 50_000, overrides: dict | None = None) -> int:
+    """匯入檔案，回傳新增到 world 的筆數（已存在的鍵只更新匯入的欄位）。"""
+    chunks = iter_parquet(path, chunk_rows) if fmt == "parquet" else iter_csv(path, chunk_rows)
+    header = next(chunks)
+    mapping = resolve_columns(header, overrides or {})
+    print("欄位對應: " + ", ".join(f"{SCHEMA[k]} ← {v}" for k, v in mapping.items()))
+
+    tq = _q(SCHEMA["table"])
+    col_country = _q(SCHEMA["country"])
+    col_date = _q(SCHEMA["date"])
+    cols = ", ".join(_q(SCHEMA[k]) for k in mapping)
+
+    conn = get_connection()
+    start = time.perf_counter()
+    staged = inserted = updated = 0
+    try:
+        with conn.cursor() as cur:
+            # world 不存在時建立（只含 SCHEMA 欄位）
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {tq} (
+                    {col_country} text,
+                    {col_date} date,
+                    {", ".join(f"{_q(SCHEMA[k])} bigint" for k in COUNT_KEYS if SCHEMA.get(k))}
+                )
+                """
+            )
+            cur.execute(f"CREATE TEMP TABLE world_staging (LIKE {tq}) ON COMMIT DROP")
+            cur.execute("ALTER TABLE world_staging ADD COLUMN _seq bigserial")
+
+            for rows in chunks:
+                cur.copy_expert(
+                    f"COPY world_staging ({cols}) FROM STDIN WITH (FORMAT csv)",
+                    _chunk_to_csv(rows, mapping),
+                )
+                staged += len(rows)
+                elapsed = max(time.perf_counter() - start, 1e-9)
+                print(f"  已暫存 {staged:,} 筆 | {elapsed:.1f} 秒 | {staged / elapsed:,.0f} 筆/秒")
+
+            # 同鍵重複時取檔案中最後一筆
+            cur.execute(
+                f"""
+                CREATE TEMP TABLE world_latest ON COMMIT DROP AS
+                SELECT DISTINCT ON ({col_country}, {col_date}) {cols}
+                FROM world_staging
+                WHERE {col_country} IS NOT NULL AND {col_date} IS NOT NULL
+                ORDER BY {col_country}, {col_date}, _seq DESC
+                """
+            )
+            # world 已有的（國家, 日期）只更新匯入的欄位，其他欄位保持不變；
+            # CSV 空白儲存格（NULL）不覆蓋既有數值
+            updates = ", ".join(
+                f"{_q(SCHEMA[k])} = COALESCE(s.{_q(SCHEMA[k])}, w.{_q(SCHEMA[k])})"
+                for k in mapping
+                if k in COUNT_KEYS
+            )
+            if updates:
+                cur.execute(
+                    f"""
+                    UPDATE {tq} w SET {updates}
+                    FROM world_latest s
+                    WHERE w.{col_country} = s.{col_country} AND w.{col_date} = s.{col_date}
+                    """
+                )
+                updated = cur.rowcount
+            # 其餘的才新增
+            cur.execute(
+                f"""
+                INSERT INTO {tq} ({cols})
+                SELECT {cols} FROM world_latest s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {tq} w
+                    WHERE w.{col_country} = s.{col_country} AND w.{col_date} = s.{col_date}
+                )
+                """
+            )
+            inserted = cur.rowcount
+        conn.commit()
+
+        # 更新統計資訊與摘要（另一個交易）
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE {tq}")
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (SCHEMA["summary_view"],))
+            if cur.fetchone()[0]:
+                cur.execute(f"REFRESH MATERIALIZED VIEW {_q(SCHEMA['summary_view'])}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(
+        f"✓ 匯入完成: 讀取 {staged:,} 筆，新增 {inserted:,} 筆，更新 {updated:,} 筆"
+        f" | {elapsed:.1f} 秒 | {staged / elapsed:,.0f} 筆/秒"
+    )
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以 COPY 大量匯入 COVID-19 資料到 world 資料表")
+    parser.add_argument("path", help="CSV 或 Parquet 檔案路徑")
+    parser.add_argument("--format", choices=("csv", "parquet"), help="檔案格式，預設依副檔名判斷")
+    parser.add_argument("--chunk-rows", type=int, default=50_000, help="每批 COPY 的筆數，預設 50000")
+    parser.add_argument(
+        "--map",
+        action="append",
+        default=[],
+        metavar="欄位=來源欄位",
+        help="指定欄位對應，例如 --map 國家=location（可重複）",
+    )
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("parquet" if args.path.endswith(".parquet") else "csv")
+    overrides = dict(item.split("=", 1) for item in args.map)
+    try:
+        load(args.path, fmt, args.chunk_rows, overrides)
+    except Exception as e:
+        print(f"✗ 匯入失敗: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
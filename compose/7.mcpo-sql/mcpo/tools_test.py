@@ -28,7 +28,16 @@ try:
         get_covid_by_date,
         get_top_countries,
         get_covid_summary,
+        get_covid_by_countries,
+        get_covid_by_dates,
+        get_covid_trend,
         list_table_columns,
+        ConnectionPool,
+        PoolTimeout,
+        ResultCache,
+        _CountryCollector,
+        _format_country,
+        OUTPUT_CONFIG,
         SCHEMA,
     )
     print("✓ 匯入成功\n")
@@ -55,6 +64,9 @@ tests = [
     ("get_covid_by_country", lambda: get_covid_by_country("台灣", limit=3), "查詢台灣疫情"),
     ("get_covid_by_date", lambda: get_covid_by_date("2024-01-15"), "查詢指定日期"),
     ("get_top_countries", lambda: get_top_countries("confirmed", limit=5), "查詢確診前 5 名"),
+    ("get_covid_by_countries", lambda: get_covid_by_countries(["台灣", "日本"], limit=2), "一次查詢多國"),
+    ("get_covid_by_dates", lambda: get_covid_by_dates(["2024-01-15", "2024-01-16"]), "一次查詢多個日期"),
+    ("get_covid_trend", lambda: get_covid_trend("台灣", "2023-01-01", "2023-12-31", "month"), "查詢每月趨勢"),
 ]
 
 all_ok = True
@@ -85,16 +97,182 @@ for name, fn, desc in tests:
 
 # 測試 8：get_top_countries 參數驗證
 print("=" * 50)
-print("測試 8：get_top_countries 無效參數")
+print("測試 8：get_top_countries / get_covid_by_date 無效參數")
 print("=" * 50)
 try:
     result = get_top_countries(metric="invalid")
     assert "metric 請填" in result, f"預期錯誤訊息，得到: {result}"
-    print("✓ 無效 metric 正確回傳錯誤訊息\n")
+    print("✓ 無效 metric 正確回傳錯誤訊息")
+    result = get_covid_by_date("2022/04/18")
+    assert "日期格式錯誤" in result, f"預期日期格式錯誤訊息，得到: {result}"
+    print("✓ 無效日期格式正確回傳錯誤訊息（不需資料庫）\n")
 except Exception as e:
     print(f"✗ 未預期錯誤: {e}\n")
     all_ok = False
 
+# 測試 9：連線池（不需資料庫，使用假連線）
+print("=" * 50)
+print("測試 9：ConnectionPool 借用、重用與上限")
+print("=" * 50)
+
+
+class _FakeConn:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+try:
+    pool = ConnectionPool(_FakeConn, min_size=1, max_size=2, checkout_timeout=0.05)
+    c1 = pool.getconn()
+    pool.putconn(c1)
+    assert pool.getconn() is c1, "歸還的連線應被重用"
+    c2 = pool.getconn()
+    try:
+        pool.getconn()
+        raise AssertionError("超過 max_size 應逾時")
+    except PoolTimeout:
+        pass
+    pool.putconn(c2, broken=True)
+    c3 = pool.getconn()
+    assert c3 is not c2 and c2.closed, "斷線的連線應被丟棄並重建"
+    stats = pool.snapshot()
+    assert stats["created"] == 3 and stats["destroyed"] == 1, stats
+    assert stats["waits"] == 1 and stats["timeouts"] == 1, stats
+    print(f"✓ 連線池正常: {stats}\n")
+except Exception as e:
+    print(f"✗ 連線池錯誤: {e}\n")
+    all_ok = False
+
+# 測試 10：非同步版本輸出與同步版本一致（需 PostgreSQL 與 psycopg 3）
+print("=" * 50)
+print("測試 10：非同步工具（DB_DRIVER=psycopg-async）")
+print("=" * 50)
+try:
+    import asyncio
+
+    import psycopg_pool  # noqa: F401
+
+    async def _compare_async():
+        pairs = [
+            (list_table_columns.aio(), list_table_columns()),
+            (get_covid_summary.aio(), get_covid_summary()),
+            (get_covid_by_country.aio("台灣", limit=3), get_covid_by_country("台灣", limit=3)),
+            (get_covid_by_date.aio("2024-01-15"), get_covid_by_date("2024-01-15")),
+            (get_top_countries.aio("confirmed", limit=5), get_top_countries("confirmed", limit=5)),
+        ]
+        # 同時送出，驗證非同步查詢可以重疊執行
+        async_results = await asyncio.gather(*(coro for coro, _ in pairs))
+        return [(a, expected) for a, (_, expected) in zip(async_results, pairs)]
+
+    for got, expected in asyncio.run(_compare_async()):
+        assert got == expected, f"非同步輸出不同:\n{got}\n---\n{expected}"
+    print("✓ 非同步版本輸出與同步版本一致\n")
+except ImportError:
+    print("- 未安裝 psycopg / psycopg-pool，略過\n")
+except Exception as e:
+    print(f"✗ 非同步工具錯誤: {e}\n")
+    all_ok = False
+
+# 測試 11：查詢結果快取（不需資料庫）
+print("=" * 50)
+print("測試 11：ResultCache LRU、TTL 與版本失效")
+print("=" * 50)
+try:
+    cache = ResultCache(max_size=2, ttl=60)
+    cache.check_version(("2024-01-15", 100))
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")  # 淘汰最久未使用的 b
+    assert cache.get("b") is None and cache.get("c") == "C"
+    cache.check_version(("2024-01-16", 120))  # 匯入新資料
+    assert cache.get("a") is None, "版本改變後應清空"
+    expired = ResultCache(max_size=2, ttl=-1)
+    expired.set("a", "A")
+    assert expired.get("a") is None, "過期結果不應回傳"
+    stats = cache.snapshot()
+    assert stats["hits"] == 2 and stats["evictions"] == 1 and stats["invalidations"] == 1, stats
+    print(f"✓ 快取正常: {stats}\n")
+except Exception as e:
+    print(f"✗ 快取錯誤: {e}\n")
+    all_ok = False
+
+# 測試 12：串流模式輸出（不需資料庫）
+print("=" * 50)
+print("測試 12：_CountryCollector 格式與截斷")
+print("=" * 50)
+try:
+    row = {"國家": "台灣", "日期": "2024-01-15", "總確診數": 10, "總死亡數": 1, "解除隔離數": None}
+    collector = _CountryCollector(["台灣"], max_chars=10_000)
+    collector.add((1, "台灣", "2024-01-15", 10, 1, None))
+    assert collector.to_text() == _format_country("台灣", [[row]]), "串流與一般模式輸出應相同"
+    small = _CountryCollector(["台灣"], max_chars=100)
+    added = sum(small.add((1, "台灣", "2024-01-15", 10, 1, None)) for _ in range(100))
+    assert small.truncated and added < 100 and "已截斷" in small.to_text()
+    print(f"✓ 串流輸出正常（上限 100 字元時保留 {added} 筆）\n")
+except Exception as e:
+    print(f"✗ 串流輸出錯誤: {e}\n")
+    all_ok = False
+
+# 測試 13：超過 stream_threshold 時經由伺服器端游標查詢（需 PostgreSQL）
+print("=" * 50)
+print("測試 13：串流模式查詢（伺服器端游標）")
+print("=" * 50)
+threshold = OUTPUT_CONFIG["stream_threshold"]
+stream_tests = [
+    ("get_covid_by_country", lambda: get_covid_by_country("台灣", limit=threshold + 1)),
+    ("get_covid_by_countries", lambda: get_covid_by_countries(["台灣", "日本"], limit=threshold // 2 + 1)),
+]
+max_chars = OUTPUT_CONFIG["max_chars"]
+try:
+    for name, fn in stream_tests:
+        result = fn()
+        assert "查詢失敗" not in result, f"{name}: {result[:150]}"
+        print(f"✓ {name}: {result.count(chr(10)) + 1} 行")
+    # 輸出達上限時中途停止讀取（游標在迴圈中途關閉），連線仍可繼續使用
+    OUTPUT_CONFIG["max_chars"] = 200
+    result = get_covid_by_country("台灣", limit=threshold + 2)
+    assert "查詢失敗" not in result and "已截斷" in result, result[:150]
+    print("✓ 截斷時提前關閉游標")
+    result = get_covid_by_country("台灣", limit=3)
+    assert "查詢失敗" not in result, result[:150]
+    print("✓ 串流後連線可繼續使用\n")
+except Exception as e:
+    print(f"✗ 串流模式錯誤: {e}\n")
+    all_ok = False
+finally:
+    OUTPUT_CONFIG["max_chars"] = max_chars
+
+# 測試 14：pg_trgm 無法使用時仍保留 btree 索引（不需資料庫，以假的 _fetch 模擬）
+print("=" * 50)
+print("測試 14：ensure_indexes 分開建立 btree 與 pg_trgm 索引")
+print("=" * 50)
+import tools
+
+real_fetch = tools._fetch
+
+
+def _fetch_without_trgm(statements):
+    if any("pg_trgm" in sql for sql, _ in statements):
+        raise RuntimeError('extension "pg_trgm" is not available')
+    return [[] for _ in statements]
+
+
+try:
+    tools._fetch = _fetch_without_trgm
+    result = tools.ensure_indexes()
+    assert result.startswith(f"已確認 {SCHEMA['table']} 的索引: world_date_confirmed_idx"), result
+    assert "未建立 world_country_trgm_idx" in result and "查詢失敗" not in result, result
+    print(f"✓ pg_trgm 失敗時保留 btree 索引:\n{result}\n")
+except Exception as e:
+    print(f"✗ ensure_indexes 錯誤: {e}\n")
+    all_ok = False
+finally:
+    tools._fetch = real_fetch
+
 # 總結
 print("=" * 50)
 if all_ok:
@@ -104,5 +282,5 @@ else:
     print("  請確認：")
     print("  1. 推薦在 Docker 內測試：docker compose run --rm postgres-mcp python tools_test.py")
     print("  2. 本機測試（PostgreSQL 在樹莓派）：DATABASE_URI=postgresql://pi:raspberry@<樹莓派IP>:5432/mydb python tools_test.py")
-    print("  3. 已建立 world 資料表並匯入 COVID-19 資料")
+    print("  3. 已建立 world 資料表並匯入 COVID-19 資料（可用 python loader.py <CSV 檔> 匯入）")
     sys.exit(1)